@@ -0,0 +1,109 @@
+from typing import Optional
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from . import util
+
+Row = tuple[str, ...]
+
+
+class ResultCache:
+    _dirname: str
+    _max_entries: int
+    _hits: int
+    _misses: int
+    _lock: threading.Lock
+
+    def __init__(self, dirname: Optional[str] = None, max_entries: int = 4096):
+        if max_entries < 1:
+            raise ValueError("Cache must hold at least one entry")
+
+        self._dirname = dirname or util.cache_dir("results")
+        self._max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[list[Row]]:
+        filename = self._filename(key)
+        try:
+            with open(filename, "r") as f:
+                rows = json.load(f)
+            # The modification time doubles as the recency for eviction
+            os.utime(filename)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return [tuple(row) for row in rows]
+
+    def put(self, key: str, rows: list[Row]) -> None:
+        os.makedirs(self._dirname, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=self._dirname, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(rows, f)
+        os.replace(tmp_filename, self._filename(key))
+        self._evict()
+
+    def clear(self) -> None:
+        for filename in self._entries():
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    def dirname(self) -> str:
+        return self._dirname
+
+    def hits(self) -> int:
+        return self._hits
+
+    def misses(self) -> int:
+        return self._misses
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self._dirname, key + ".json")
+
+    def _entries(self) -> list[str]:
+        try:
+            filenames = os.listdir(self._dirname)
+        except FileNotFoundError:
+            return []
+        return [
+            os.path.join(self._dirname, filename)
+            for filename in filenames
+            if filename.endswith(".json")
+        ]
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        if len(entries) <= self._max_entries:
+            return
+
+        def recency(filename: str) -> float:
+            try:
+                return os.path.getmtime(filename)
+            except FileNotFoundError:
+                return 0.0
+
+        entries.sort(key=recency)
+        for filename in entries[: len(entries) - self._max_entries]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
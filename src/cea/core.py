@@ -1,15 +1,127 @@
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
-from typing import Callable, Optional
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, TypeVar
 
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
 import inspect
-
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+
+from . import engine
+from . import magic
 from . import souffle
+from .cache import ResultCache, Row
 
 from .util import override
 
+if TYPE_CHECKING:
+    from .facts import FactStore
+
+
+###############################################################################
+# Interning
+
+_instances: "weakref.WeakValueDictionary[tuple[object, ...], Interned]"
+_instances = weakref.WeakValueDictionary()
+_instances_lock = threading.Lock()
+
+
+# Building a term or atom that is structurally equal to a live one returns the
+# live one, so equality is identity and hashes are computed once. Instances are
+# immutable once interned. Classes that define __eq__ (like the sorts building
+# constraint atoms) keep the cached hash.
+class InternedMeta(ABCMeta):
+    def __new__(
+        mcs,
+        name: str,
+        bases: tuple[type, ...],
+        namespace: dict[str, object],
+        **kwargs: object,
+    ) -> "InternedMeta":
+        if "__eq__" in namespace and "__hash__" not in namespace:
+            namespace["__hash__"] = Interned.__hash__
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+    def __call__(cls, *args: object, **kwargs: object) -> object:
+        return _intern(super().__call__(*args, **kwargs))
+
+
+class Interned(metaclass=InternedMeta):
+    __slots__ = ("__weakref__", "_hash")
+
+    _hash: int
+
+    # The instance's fields, which must be hashable
+    def _key(self) -> tuple[object, ...]:
+        return tuple(_fields(self).values())
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __setattr__(self, name: str, value: object) -> None:
+        if hasattr(self, "_hash"):
+            raise AttributeError(f"{type(self).__qualname__} is immutable")
+        super().__setattr__(name, value)
+
+    def __reduce__(self) -> tuple[object, ...]:
+        return (type(self)._from_fields, (_fields(self),))
+
+    # Skips __init__, so callers vouch for the fields
+    @classmethod
+    def _from_fields(cls: type["I"], fields: dict[str, object]) -> "I":
+        obj = object.__new__(cls)
+        for name, value in fields.items():
+            object.__setattr__(obj, name, value)
+        ret = _intern(obj)
+        assert isinstance(ret, cls)
+        return ret
+
+
+I = TypeVar("I", bound=Interned)
+
+
+def _intern(obj: Interned) -> Interned:
+    key = (type(obj), obj._key())
+    with _instances_lock:
+        existing = _instances.get(key)
+        if existing is not None:
+            return existing
+        object.__setattr__(obj, "_hash", hash(key))
+        _instances[key] = obj
+        return obj
+
+
+@functools.cache
+def _slot_names(cls: type) -> tuple[str, ...]:
+    return tuple(
+        name
+        for klass in cls.__mro__
+        for name in getattr(klass, "__slots__", ())
+        if name not in Interned.__slots__
+    )
+
+
+def _fields(obj: Interned) -> dict[str, object]:
+    ret = {name: getattr(obj, name) for name in _slot_names(type(obj))}
+    ret.update(getattr(obj, "__dict__", {}))
+    return ret
+
+
+###############################################################################
+# Terms and atoms
+
+
+# One instance per sort class
+class Sort(Interned):
+    __slots__ = ()
 
-class Sort(metaclass=ABCMeta):
     @abstractmethod
     def dl_repr(self) -> str:
         ...
@@ -23,7 +135,9 @@ class Sort(metaclass=ABCMeta):
         ...
 
 
-class Term(metaclass=ABCMeta):
+class Term(Interned):
+    __slots__ = ()
+
     @classmethod
     @abstractmethod
     def sort(cls) -> Sort:
@@ -49,8 +163,19 @@ class Term(metaclass=ABCMeta):
     def substitute(self, lhs: str, rhs: "Term") -> "Term":
         return self
 
+    def substitute_all(self, assignment: "Assignment") -> "Term":
+        return self
+
+    def fact_repr(self) -> str:
+        s = self.dl_repr()
+        if len(s) >= 2 and s[0] == '"' and s[-1] == '"':
+            return s[1:-1]
+        return s
+
 
 class Var(Term):
+    __slots__ = ("_name",)
+
     _name: str
 
     def __init__(self, name: str):
@@ -79,15 +204,19 @@ class Var(Term):
         else:
             return self
 
-    def __hash__(self) -> int:
-        return hash(self._name)
+    @override
+    def substitute_all(self, assignment: "Assignment") -> Term:
+        return assignment.get(self._name, self)
 
 
 Arity = OrderedDict[str, Sort]
 Assignment = dict[str, Term]
 
 
-class Relation:
+# Interned by name and signature
+class Relation(Interned):
+    __slots__ = ("_name", "_arity", "_infix_symbol")
+
     _name: str
     _arity: Arity
     _infix_symbol: Optional[str]
@@ -102,37 +231,41 @@ class Relation:
             assert len(arity) == 2
 
         self._name = name
-        self._arity = arity
+        self._arity = OrderedDict(arity)
         self._infix_symbol = infix_symbol
 
-    def __eq__(self, other: object) -> bool:
-        if not isinstance(other, Relation):
-            return False
-        if self.name() != other.name():
-            return False
-        if self.infix_symbol != other.infix_symbol:
-            return False
-        if self.arity() != other.arity():
-            return False
-        return True
+    def _key(self) -> tuple[object, ...]:
+        return (self._name, tuple(self._arity.items()), self._infix_symbol)
 
     def arity(self) -> Arity:
         return self._arity
 
-    def dl_repr(self, output: bool = False) -> str:
+    # Interned symbol sorts are declared as numbers
+    def dl_repr(
+        self,
+        output: bool = False,
+        input: bool = False,
+        interned: bool = False,
+    ) -> str:
         if self.infix_symbol():
-            if output:
-                raise ValueError("Cannot output infix relation")
+            if output or input:
+                raise ValueError("Cannot input or output infix relation")
             return ""
 
         ret = (
             f".decl {self.name()}("
             + ", ".join(
-                [f"{name}: {sort.dl_repr()}" for name, sort in self.arity().items()]
+                [
+                    f"{name}: {'number' if interned and _interned(sort) else sort.dl_repr()}"
+                    for name, sort in self.arity().items()
+                ]
             )
             + ")"
         )
 
+        if input:
+            ret += f"\n.input {self.name()}"
+
         if output:
             ret += f"\n.output {self.name()}"
 
@@ -148,31 +281,28 @@ class Relation:
         return self._name
 
 
-class Atom(metaclass=ABCMeta):
+class Atom(Interned):
+    __slots__ = ()
+
     @abstractmethod
     def get_arg(self, key: str) -> Term:
         ...
 
+    # Replaces the given arguments at once
     @abstractmethod
-    def set_arg(self, key: str, val: Term) -> "Atom":
+    def set_args(self, args: dict[str, Term]) -> "Atom":
         ...
 
     @abstractmethod
     def relation(self) -> Relation:
         ...
 
-    def __eq__(self, other: object) -> bool:
-        if not isinstance(other, Atom):
-            return False
-        if self.relation() != other.relation():
-            return False
-        for k in self.relation().arity():
-            if self.get_arg(k) != other.get_arg(k):
-                return False
-        return True
-
-    def __hash__(self) -> int:
-        return hash(self.dl_repr())
+    # Arguments are interned, so they are identified by identity (and kept alive
+    # as long as the atom is)
+    def _key(self) -> tuple[object, ...]:
+        return (self.relation(),) + tuple(
+            id(self.get_arg(k)) for k in self.relation().arity()
+        )
 
     def dl_repr(self) -> str:
         infix_symbol = self.relation().infix_symbol()
@@ -206,20 +336,46 @@ class Atom(metaclass=ABCMeta):
                 return False
         return True
 
+    def set_arg(self, key: str, val: Term) -> "Atom":
+        return self.set_args({key: val})
+
     def substitute(self, lhs: str, rhs: Term) -> "Atom":
-        new_atom = self
-        for k in self.relation().arity():
-            new_atom = new_atom.set_arg(k, self.get_arg(k).substitute(lhs, rhs))
-        return new_atom
+        return self.substitute_all({lhs: rhs})
 
+    # Simultaneous substitution, building at most one new atom
     def substitute_all(self, assignment: Assignment) -> "Atom":
-        new_atom = self
-        for lhs, rhs in assignment.items():
-            new_atom = new_atom.substitute(lhs, rhs)
-        return new_atom
+        new_args = {}
+        for k in self.relation().arity():
+            arg = self.get_arg(k)
+            new_arg = arg.substitute_all(assignment)
+            if new_arg is not arg:
+                new_args[k] = new_arg
+        return self.set_args(new_args) if new_args else self
+
+
+# An atom with its variables located once, for repeated substitution
+class AtomTemplate:
+    _atom: Atom
+    _variables: tuple[tuple[str, str], ...]
+
+    def __init__(self, atom: Atom):
+        self._atom = atom
+        self._variables = tuple(
+            (k, atom.get_arg(k).dl_repr())
+            for k in atom.relation().arity()
+            if isinstance(atom.get_arg(k), Var)
+        )
+
+    def substitute_all(self, assignment: Assignment) -> Atom:
+        new_args = {
+            k: assignment[name] for k, name in self._variables if name in assignment
+        }
+        return self._atom.set_args(new_args) if new_args else self._atom
 
 
 class DynamicAtom(Atom):
+    __slots__ = ("_relation", "_args")
+
     _relation: Relation
     _args: dict[str, Term]
 
@@ -234,18 +390,20 @@ class DynamicAtom(Atom):
             assert args[k].sort() == ra[k]
 
         self._relation = relation
-        self._args = args
+        self._args = dict(args)
 
     @override
     def get_arg(self, key: str) -> Term:
         return self._args[key]
 
     @override
-    def set_arg(self, key: str, val: Term) -> "Atom":
-        assert val.sort() == self.relation().arity()[key]
-        new_args = self._args.copy()
-        new_args[key] = val
-        return DynamicAtom(self._relation, new_args)
+    def set_args(self, args: dict[str, Term]) -> "Atom":
+        ra = self._relation.arity()
+        for k, v in args.items():
+            assert v.sort() == ra[k]
+        return DynamicAtom._from_fields(
+            {"_relation": self._relation, "_args": {**self._args, **args}}
+        )
 
     @override
     def relation(self) -> Relation:
@@ -263,6 +421,7 @@ class Rule:
     _head: Atom
     _dependencies: OrderedDict[str, Atom]
     _checks: tuple[Atom, ...]
+    _templates: Optional[list[AtomTemplate]]
 
     def __init__(
         self,
@@ -273,6 +432,7 @@ class Rule:
         self._head = head
         self._dependencies = dependencies
         self._checks = checks
+        self._templates = None
 
     def body(self) -> list[Atom]:
         return list(self.dependencies().values()) + list(self._checks)
@@ -283,6 +443,24 @@ class Rule:
     def head(self) -> Atom:
         return self._head
 
+    def substitute_body(self, assignment: Assignment) -> list[Atom]:
+        return [t.substitute_all(assignment) for t in self._body_templates()]
+
+    def substitute_dependencies(
+        self,
+        assignment: Assignment,
+    ) -> OrderedDict[str, Atom]:
+        return OrderedDict(
+            (k, t.substitute_all(assignment))
+            for k, t in zip(self._dependencies, self._body_templates())
+        )
+
+    # Compiled on first use
+    def _body_templates(self) -> list[AtomTemplate]:
+        if self._templates is None:
+            self._templates = [AtomTemplate(a) for a in self.body()]
+        return self._templates
+
     def dl_repr(self) -> str:
         lhs = self.head().dl_repr()
         rhs = ",\n  ".join([r.dl_repr() for r in self.body()]) + "."
@@ -325,12 +503,28 @@ class NamedRule:
 class Query:
     _rule: Rule
 
-    def __init__(self, atoms: list[Atom]):
+    # Projected onto the given variables (deduplicated) if there are any
+    def __init__(
+        self,
+        atoms: list[Atom],
+        name: str = "Goal",
+        variables: Optional[Iterable[str]] = None,
+    ):
+        free_variables = {
+            fv.dl_repr(): fv for fv in set.union(*[a.free_variables() for a in atoms])
+        }
+        if variables is None:
+            names = set(free_variables)
+        else:
+            names = set(variables)
+            if not names <= free_variables.keys():
+                raise ValueError("Projection onto variables not in query")
+
+        # Sorted so that the program text is stable across processes
         goal_relation = Relation(
-            name="Goal",
+            name=name,
             arity=OrderedDict(
-                (fv.dl_repr(), fv.sort())
-                for fv in set.union(*[a.free_variables() for a in atoms])
+                (name, free_variables[name].sort()) for name in sorted(names)
             ),
         )
         head = DynamicAtom.free(goal_relation, prefix="")
@@ -349,67 +543,1009 @@ class Query:
             ]
         )
 
+    def atoms(self) -> list[Atom]:
+        return list(self._rule.dependencies().values())
+
+    def head(self) -> Atom:
+        return self._rule.head()
+
+    def name(self) -> str:
+        return self.relation().name()
+
     def relation(self) -> Relation:
         return self._rule.head().relation()
 
+    # Replaces every ground argument of the query by a variable bound through a
+    # single Param fact, so that queries of the same shape share program text
+    def parameterized(self) -> tuple["Query", Optional[Atom]]:
+        params: OrderedDict[str, Term] = OrderedDict()
+
+        def abstract(atom: Atom) -> Atom:
+            new_atom = atom
+            for k in atom.relation().arity():
+                arg = atom.get_arg(k)
+                if arg.ground():
+                    name = f"param__{len(params)}"
+                    params[name] = arg
+                    new_atom = new_atom.set_arg(k, arg.sort().var(name))
+            return new_atom
+
+        atoms = [abstract(a) for a in self.atoms()]
+
+        if not params:
+            return self, None
+
+        param_relation = Relation(
+            name=f"{self.name()}_Param",
+            arity=OrderedDict((k, v.sort()) for k, v in params.items()),
+        )
+        # First, so that its bindings flow into the rest of the body
+        atoms.insert(0, DynamicAtom.free(param_relation, prefix=""))
+        return (
+            Query(atoms, name=self.name(), variables=self.relation().arity()),
+            DynamicAtom(param_relation, dict(params)),
+        )
+
+
+# Dense integer ids for the terms of symbol sorts, so that engines join on
+# numbers and output rows decode by lookup
+class SymbolTable:
+    _ids: dict[tuple[Sort, str], int]
+    _terms: list[Term]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._ids = {}
+        self._terms = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def encode(self, term: Term) -> int:
+        key = (term.sort(), term.dl_repr())
+        with self._lock:
+            if key not in self._ids:
+                self._ids[key] = len(self._terms)
+                self._terms.append(term)
+            return self._ids[key]
+
+    def decode(self, id: int) -> Term:
+        return self._terms[id]
+
+
+# A frozen snapshot of a list of rules with everything that depends on the
+# rules alone computed up front: the relations they mention, the constants that
+# get the first symbol ids, and the engine clauses (and their text) under those
+# ids. It can be pickled, so that processes load it instead of rebuilding it.
+@dataclass(frozen=True, eq=False)
+class CompiledLibrary:
+    rules: tuple[NamedRule, ...]
+    relations: tuple[Relation, ...]
+    # The symbol with id i is symbols[i]
+    symbols: tuple[Term, ...]
+    clauses: tuple[engine.Clause, ...]
+    clause_texts: tuple[str, ...]
+    # Input declarations of the relations, in the same order
+    declarations: tuple[str, ...]
+    fingerprint: str
+
+    @staticmethod
+    def of(rules: Iterable[NamedRule]) -> "CompiledLibrary":
+        rules = tuple(rules)
+
+        # Insertion-ordered set
+        relations: dict[Relation, None] = {}
+        symbols = SymbolTable()
+        for idb in rules:
+            for a in [idb.rule().head()] + idb.rule().body():
+                if not a.relation().infix_symbol():
+                    relations[a.relation()] = None
+                for k in a.relation().arity():
+                    term = a.get_arg(k)
+                    if term.ground() and _interned(term.sort()):
+                        symbols.encode(term)
+
+        clauses = tuple(_engine_clause(idb.rule(), symbols) for idb in rules)
+        clause_texts = tuple(
+            f"// {idb.name()}\n{clause.dl_repr()}"
+            for idb, clause in zip(rules, clauses)
+        )
+        declarations = tuple(r.dl_repr(input=True, interned=True) for r in relations)
+        terms = tuple(symbols.decode(i) for i in range(len(symbols)))
+
+        return CompiledLibrary(
+            rules=rules,
+            relations=tuple(relations),
+            symbols=terms,
+            clauses=clauses,
+            clause_texts=clause_texts,
+            declarations=declarations,
+            # The texts show constants as ids, so the terms behind them count
+            fingerprint=ResultCache.key(
+                *clause_texts,
+                *declarations,
+                *(f"{type(t.sort()).__qualname__} {t.dl_repr()}" for t in terms),
+            ),
+        )
+
+    def save(self, filename: str) -> None:
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(self, f)
+        os.replace(tmp_filename, filename)
+
+    @staticmethod
+    def load(filename: str) -> "CompiledLibrary":
+        with open(filename, "rb") as f:
+            ret = pickle.load(f)
+        if not isinstance(ret, CompiledLibrary):
+            raise ValueError(f"No compiled library in {filename}")
+        return ret
+
 
 class DatalogProgram:
     _edbs: list[Atom]
+    _edb_set: set[Atom]
+    _edb_groups: dict[Relation, list[Atom]]
+    _edb_indexes: dict[
+        tuple[Relation, tuple[str, ...]],
+        dict[tuple[int, ...], list[Atom]],
+    ]
+    _facts: Optional["FactStore"]
+    _library: CompiledLibrary
     _idbs: list[NamedRule]
+    _idb_indexes: dict[NamedRule, int]
+    _declarations: dict[Relation, str]
+    _idbs_by_head: dict[Relation, list[NamedRule]]
     _relations: list[Relation]
+    _symbols: SymbolTable
+    _backend: "Backend"
+    _cache: Optional[ResultCache]
+    _magic_sets: bool
+    _engine: Optional[engine.Engine]
+    _provenance_engine: Optional[engine.Engine]
+    _fact_dir: Optional[tempfile.TemporaryDirectory[str]]
+    _lock: threading.Lock
+    _cache_prefix: Optional[str]
+    _dependencies: dict[str, set[str]]
+    _slices: dict[frozenset[str], tuple[list[Relation], list[NamedRule]]]
 
-    def __init__(self, edbs: list[Atom], idbs: list[NamedRule]):
-        self._relations = []
+    def __init__(
+        self,
+        edbs: list[Atom],
+        idbs: list[NamedRule] | CompiledLibrary,
+        backend: Optional["Backend"] = None,
+        cache: Optional[ResultCache] = None,
+        magic_sets: bool = False,
+        facts: Optional["FactStore"] = None,
+    ):
+        library = (
+            idbs if isinstance(idbs, CompiledLibrary) else CompiledLibrary.of(idbs)
+        )
 
+        # Insertion-ordered set
+        relations: dict[Relation, None] = {}
+
+        def add(r: Relation) -> None:
+            if not r.infix_symbol():
+                relations[r] = None
+
+        self._edb_groups = {}
         for edb in edbs:
             if not edb.ground():
                 raise ValueError("Non-ground EDB")
-            r = edb.relation()
-            if r not in self._relations:
-                self._relations.append(r)
-
-        for idb in idbs:
-            r = idb.rule().head().relation()
-            if r not in self._relations:
-                self._relations.append(r)
-
-        self._edbs = edbs
-        self._idbs = idbs
+            add(edb.relation())
+            self._edb_groups.setdefault(edb.relation(), []).append(edb)
+        if facts is not None:
+            for r in facts.relations():
+                add(r)
+
+        for r in library.relations:
+            add(r)
+
+        # Relation name -> names of the relations its rules read from
+        self._dependencies = {}
+        self._idbs_by_head = {}
+
+        for idb in library.rules:
+            head_name = idb.rule().head().relation().name()
+            self._idbs_by_head.setdefault(idb.rule().head().relation(), []).append(idb)
+            deps = self._dependencies.setdefault(head_name, set())
+            for a in idb.rule().body():
+                if not a.relation().infix_symbol():
+                    deps.add(a.relation().name())
+
+        self._relations = list(relations)
+
+        # Ids depend only on the rules and the set of EDB terms, so rows cached
+        # for one program stay valid for every equivalent one; the rules'
+        # constants come first, so the library's clauses hold the right ids
+        self._symbols = SymbolTable()
+        for term in library.symbols:
+            self._symbols.encode(term)
+        edb_symbols = {
+            (type(term.sort()).__qualname__, term.dl_repr()): term
+            for edb in edbs
+            for term in (edb.get_arg(k) for k in edb.relation().arity())
+            if _interned(term.sort())
+        }
+        if facts is not None:
+            for sort, strings in facts.symbols().items():
+                for s in strings:
+                    term = sort.parse(s)
+                    edb_symbols[type(sort).__qualname__, term.dl_repr()] = term
+        for key in sorted(edb_symbols):
+            self._symbols.encode(edb_symbols[key])
+
+        # Copied, since add_edbs appends to it
+        self._edbs = list(edbs)
+        self._edb_set = set(edbs)
+        self._edb_indexes = {}
+        self._facts = facts
+        self._library = library
+        self._idbs = list(library.rules)
+        self._idb_indexes = {idb: i for i, idb in enumerate(library.rules)}
+        self._declarations = dict(zip(library.relations, library.declarations))
+        self._backend = backend or get_backend()
+        self._cache = cache
+        self._magic_sets = magic_sets
+        self._engine = None
+        self._provenance_engine = None
+        self._fact_dir = None
+        self._cache_prefix = None
+        self._lock = threading.Lock()
+        self._slices = {}
+
+    # Restricted to what the queries can reach if any are given
+    def dl_repr(
+        self,
+        queries: Optional[list[Query]] = None,
+    ) -> str:
+        if queries is None:
+            relations, idbs = self._relations, self._idbs
+        else:
+            relations, idbs = self.slice(queries)
 
-    def dl_repr(self) -> str:
         blocks = []
 
-        for r in self._relations:
+        for r in relations:
             blocks.append(r.dl_repr())
 
         blocks.append("")
 
-        for idb in self._idbs:
+        for idb in idbs:
             blocks.append(idb.dl_repr())
             blocks.append("")
 
-        for edb in self._edbs:
-            blocks.append(edb.dl_repr() + ".")
+        for r in relations:
+            for edb in self._edb_groups.get(r, []) + self._stored(r):
+                blocks.append(edb.dl_repr() + ".")
 
         blocks.append("")
 
         return "\n".join(blocks)
 
+    # Materializes the facts of the store, if any
     def edbs(self) -> list[Atom]:
-        return self._edbs
+        if self._facts is None:
+            return self._edbs
+        return self._edbs + self._facts.atoms()
+
+    # A materialization that already exists is brought up to date by
+    # propagating only the new EDBs through it
+    def add_edbs(self, edbs: Iterable[Atom]) -> None:
+        groups: dict[Relation, list[Atom]] = {}
+        seen: set[Atom] = set()
+        for edb in edbs:
+            if not edb.ground():
+                raise ValueError("Non-ground EDB")
+            if edb not in seen and not self.is_edb(edb):
+                seen.add(edb)
+                groups.setdefault(edb.relation(), []).append(edb)
+        if not groups:
+            return
+
+        with self._lock:
+            if any(r not in self._relations for r in groups):
+                self._relations = self._relations + [
+                    r for r in groups if r not in self._relations
+                ]
+                self._slices = {}
+
+            new_symbols = {
+                (type(term.sort()).__qualname__, term.dl_repr()): term
+                for group in groups.values()
+                for edb in group
+                for term in (edb.get_arg(k) for k in edb.relation().arity())
+                if _interned(term.sort())
+            }
+            for key in sorted(new_symbols):
+                self._symbols.encode(new_symbols[key])
+
+            # Extended in place, so each call costs what it adds
+            for r, group in groups.items():
+                self._edbs.extend(group)
+                self._edb_set.update(group)
+                self._edb_groups.setdefault(r, []).extend(group)
+                for (relation, keys), index in self._edb_indexes.items():
+                    if relation != r:
+                        continue
+                    for edb in group:
+                        index_key = tuple(id(edb.get_arg(k)) for k in keys)
+                        index.setdefault(index_key, []).append(edb)
+
+            self._cache_prefix = None
+            for e in (self._engine, self._provenance_engine):
+                if e is not None:
+                    self._add_rows(e, groups)
+            if self._fact_dir is not None:
+                self._write_facts(
+                    self._fact_dir.name, list(groups), groups, append=True
+                )
+
+    def is_edb(self, atom: Atom) -> bool:
+        return atom in self._edb_set or (
+            self._facts is not None and self._facts.contains(atom)
+        )
+
+    # The EDBs of the relation with the given arguments
+    def edbs_of(self, relation: Relation, **args: Term) -> list[Atom]:
+        ret = self._indexed_edbs(relation, args)
+        if self._facts is not None:
+            ret = ret + self._facts.matching(relation, **args)
+        return ret
+
+    # Looked up in a hash index on the argument names that is built on first use
+    def _indexed_edbs(self, relation: Relation, args: dict[str, Term]) -> list[Atom]:
+        group = self._edb_groups.get(relation, [])
+        if not args:
+            return group
+
+        keys = tuple(sorted(args))
+        if not set(keys) <= relation.arity().keys():
+            raise ValueError(f"Unknown arguments for relation {relation.name()}")
+
+        # Terms are interned, so they are identified by identity
+        with self._lock:
+            index = self._edb_indexes.get((relation, keys))
+            if index is None:
+                index = {}
+                for edb in group:
+                    key = tuple(id(edb.get_arg(k)) for k in keys)
+                    index.setdefault(key, []).append(edb)
+                self._edb_indexes[relation, keys] = index
+
+        return index.get(tuple(id(args[k]) for k in keys), [])
 
     def idbs(self) -> list[NamedRule]:
         return self._idbs
 
-    def run_query(self, query: Query) -> list[Assignment]:
-        dl_prog = self.dl_repr() + "\n" + query.dl_repr()
-        output = souffle.run(dl_prog)
-
-        goal_relation = query.relation()
-        assignments = []
-        for row in output.facts[goal_relation.name()]:
-            assignment = {}
-            for (key, key_sort), val in zip(goal_relation.arity().items(), row):
-                assignment[key] = key_sort.parse(val)
-            assignments.append(assignment)
-        return assignments
+    def library(self) -> CompiledLibrary:
+        return self._library
+
+    # The rules deriving the relation, in program order
+    def idbs_for(self, relation: Relation) -> list[NamedRule]:
+        return self._idbs_by_head.get(relation, [])
+
+    # The relations the queries (transitively) depend on, and the rules that
+    # derive them
+    def slice(self, queries: list[Query]) -> tuple[list[Relation], list[NamedRule]]:
+        roots = frozenset(
+            a.relation().name()
+            for q in queries
+            for a in q.atoms()
+            if not a.relation().infix_symbol()
+        )
+
+        if roots not in self._slices:
+            reachable = set(roots)
+            worklist = list(roots)
+            while worklist:
+                name = worklist.pop()
+                for dep in self._dependencies.get(name, set()):
+                    if dep not in reachable:
+                        reachable.add(dep)
+                        worklist.append(dep)
+
+            self._slices[roots] = (
+                [r for r in self._relations if r.name() in reachable],
+                [
+                    idb
+                    for idb in self._idbs
+                    if idb.rule().head().relation().name() in reachable
+                ],
+            )
+
+        return self._slices[roots]
+
+    def backend(self) -> "Backend":
+        return self._backend
+
+    def magic_sets(self) -> bool:
+        return self._magic_sets
+
+    def magic_rewrite(self, queries: list[Query]) -> magic.Rewrite:
+        _, idbs = self.slice(queries)
+        return magic.rewrite(
+            [self._library.clauses[self._idb_indexes[idb]] for idb in idbs],
+            [self._engine_body(q) for q in queries],
+        )
+
+    # The Souffle program for the queries, reading the given relations from
+    # fact files, with symbols interned throughout
+    def _souffle_dl_repr(
+        self,
+        queries: list[Query],
+        input_relations: list[Relation],
+        limit: Optional[int] = None,
+    ) -> str:
+        blocks = []
+
+        for r in input_relations:
+            declaration = self._declarations.get(r)
+            blocks.append(declaration or r.dl_repr(input=True, interned=True))
+
+        if self._magic_sets:
+            rw = self.magic_rewrite(queries)
+            by_name = {r.name(): r for r in input_relations}
+
+            for name, (source, positions) in rw.derived.items():
+                arity = list(by_name[source].arity().items())
+                blocks.append(
+                    Relation(
+                        name=name,
+                        arity=OrderedDict(arity[i] for i in positions),
+                    ).dl_repr(interned=True)
+                )
+
+            blocks.append("")
+
+            for clause in rw.clauses:
+                blocks.append(clause.dl_repr())
+                blocks.append("")
+
+            bodies = rw.queries
+        else:
+            _, idbs = self.slice(queries)
+
+            blocks.append("")
+
+            for idb in idbs:
+                blocks.append(self._library.clause_texts[self._idb_indexes[idb]])
+                blocks.append("")
+
+            bodies = [self._engine_body(q) for q in queries]
+
+        for q, body in zip(queries, bodies):
+            blocks.append(q.relation().dl_repr(output=True, interned=True))
+            if limit is not None:
+                blocks.append(f".limitsize {q.name()}(n={limit})")
+            blocks.append("")
+            blocks.append(
+                engine.Clause(
+                    head=self._engine_literal(q.head()),
+                    body=body,
+                ).dl_repr()
+            )
+            blocks.append("")
+
+        return "\n".join(blocks)
+
+    # The rule that first derived the ground atom and the assignment it was
+    # derived with, or None if the atom is an EDB or not derivable; always
+    # answered by the in-process engine, whatever the backend
+    def provenance(self, atom: Atom) -> Optional[tuple[NamedRule, Assignment]]:
+        if not atom.ground():
+            raise ValueError("Cannot explain non-ground atom")
+
+        p = self._materialized(provenance=True).provenance(
+            atom.relation().name(),
+            self._engine_row(atom),
+        )
+        if p is None:
+            return None
+
+        index, binding = p
+        idb = self._idbs[index]
+        sorts = _variable_sorts(idb.rule())
+        return idb, {name: self._term(sorts[name], v) for name, v in binding.items()}
+
+    # At most limit assignments (in no particular order) if a limit is given
+    def run_query(
+        self,
+        query: Query,
+        limit: Optional[int] = None,
+    ) -> list[Assignment]:
+        return self.run_queries([query], limit=limit)[0]
+
+    # Evaluates all queries with a single engine invocation; their names must
+    # be distinct
+    def run_queries(
+        self,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Assignment]]:
+        keys, results = self._lookup(queries, limit)
+        missing = [q for q, rows in zip(queries, results) if rows is None]
+        fresh = self._backend.run(self, missing, limit) if missing else []
+        return self._store(queries, keys, results, fresh)
+
+    # Stops at the first witness
+    def exists(self, query: Query) -> bool:
+        return bool(self.run_query(query, limit=1))
+
+    # Evaluates a ground infix atom without an engine invocation, comparing
+    # the values the engines would see
+    def holds(self, check: Atom) -> bool:
+        symbol = check.relation().infix_symbol()
+        if not symbol or not check.ground():
+            raise ValueError("Expected ground infix atom")
+        lhs, rhs = (
+            self._engine_value(check.get_arg(k)) for k in check.relation().arity()
+        )
+        if symbol == "=":
+            return lhs == rhs
+        if symbol == "<":
+            return lhs < rhs  # type: ignore[operator]
+        raise ValueError(f"Unknown infix symbol {symbol}")
+
+    async def run_query_async(
+        self,
+        query: Query,
+        limit: Optional[int] = None,
+    ) -> list[Assignment]:
+        return (await self.run_queries_async([query], limit=limit))[0]
+
+    async def run_queries_async(
+        self,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Assignment]]:
+        keys, results = self._lookup(queries, limit)
+        missing = [q for q, rows in zip(queries, results) if rows is None]
+        fresh = await self._backend.run_async(self, missing, limit) if missing else []
+        return self._store(queries, keys, results, fresh)
+
+    def _lookup(
+        self,
+        queries: list[Query],
+        limit: Optional[int],
+    ) -> tuple[list[str], list[Optional[list[Row]]]]:
+        if limit is not None and limit < 1:
+            raise ValueError("Limit must be positive")
+        if len({q.name() for q in queries}) != len(queries):
+            raise ValueError("Batched queries must have distinct names")
+
+        keys: list[str] = []
+        results: list[Optional[list[Row]]] = [None] * len(queries)
+        if self._cache is not None:
+            for i, q in enumerate(queries):
+                parts = [self._normalized_repr(), q.dl_repr()]
+                if limit is not None:
+                    parts.append(f"limit={limit}")
+                key = ResultCache.key(*parts)
+                keys.append(key)
+                results[i] = self._cache.get(key)
+        return keys, results
+
+    # Fills the cache misses with the fresh results, in order. Symbol ids are
+    # private to a program, so the cache holds fact representations instead.
+    def _store(
+        self,
+        queries: list[Query],
+        keys: list[str],
+        results: list[Optional[list[Row]]],
+        fresh: list[list[Row]],
+    ) -> list[list[Assignment]]:
+        fresh_iter = iter(fresh)
+        ret = []
+        for i, q in enumerate(queries):
+            rows = results[i]
+            if rows is None:
+                assignments = self._parse_rows(q, next(fresh_iter))
+                if self._cache is not None:
+                    self._cache.put(keys[i], _fact_rows(q, assignments))
+            else:
+                assignments = _parse_fact_rows(q, rows)
+            ret.append(assignments)
+        return ret
+
+    # Independent of EDB order and duplication, so equivalent traces share
+    # cache entries
+    def _normalized_repr(self) -> str:
+        if self._cache_prefix is None:
+            self._cache_prefix = ResultCache.key(
+                self._library.fingerprint,
+                *(r.dl_repr() for r in self._relations),
+                *sorted({edb.dl_repr() for edb in self._edbs}),
+                self._facts.fingerprint() if self._facts is not None else "",
+            )
+        return self._cache_prefix
+
+    # Evaluated once per program and shared by every query against it.
+    # Recording provenance costs memory and time, so it gets its own engine,
+    # built on the first request for it
+    def _materialized(self, provenance: bool = False) -> engine.Engine:
+        with self._lock:
+            e = self._provenance_engine if provenance else self._engine
+            if e is None:
+                e = engine.Engine(self._library.clauses, provenance=provenance)
+                self._add_edbs(e)
+                if provenance:
+                    self._provenance_engine = e
+                else:
+                    self._engine = e
+            # Only propagates what was added since the last run
+            e.run()
+            return e
+
+    def _add_edbs(self, e: engine.Engine) -> None:
+        self._add_rows(e, self._edb_groups)
+        if self._facts is not None:
+            for r in self._facts.relations():
+                columns = self._facts.values(r, self._encode_symbol)
+                e.add(r.name(), zip(*(c.tolist() for c in columns)))
+
+    def _add_rows(self, e: engine.Engine, groups: dict[Relation, list[Atom]]) -> None:
+        for r, edbs in groups.items():
+            e.add(r.name(), [self._engine_row(edb) for edb in edbs])
+
+    # Written once per program and reused by every query against it
+    def _fact_dirname(self) -> str:
+        with self._lock:
+            if self._fact_dir is None:
+                fact_dir = tempfile.TemporaryDirectory()
+                self._write_facts(fact_dir.name, self._relations, self._edb_groups)
+                if self._facts is not None:
+                    for r in self._facts.relations():
+                        with open(f"{fact_dir.name}/{r.name()}.facts", "a") as f:
+                            self._facts.write_facts(f, r, self._encode_symbol)
+                self._fact_dir = fact_dir
+            return self._fact_dir.name
+
+    def _write_facts(
+        self,
+        dirname: str,
+        relations: list[Relation],
+        groups: dict[Relation, list[Atom]],
+        append: bool = False,
+    ) -> None:
+        for r in relations:
+            with open(f"{dirname}/{r.name()}.facts", "a" if append else "w") as f:
+                f.writelines(
+                    "\t".join(str(v) for v in self._engine_row(atom)) + "\n"
+                    for atom in groups.get(r, [])
+                )
+
+    def _stored(self, relation: Relation) -> list[Atom]:
+        if self._facts is None:
+            return []
+        return self._facts.atoms(relation)
+
+    def _encode_symbol(self, sort: Sort, symbol: str) -> int:
+        return self._symbols.encode(sort.parse(symbol))
+
+    def _parse_rows(self, query: Query, rows: list[Row]) -> list[Assignment]:
+        arity = list(query.relation().arity().items())
+        return [
+            {key: self._term(key_sort, val) for (key, key_sort), val in zip(arity, row)}
+            for row in rows
+        ]
+
+    def _term(self, sort: Sort, value: engine.Value) -> Term:
+        if _interned(sort):
+            return self._symbols.decode(int(value))
+        return sort.parse(str(value))
+
+    def _engine_body(self, query: Query) -> tuple[engine.Literal, ...]:
+        return tuple(self._engine_literal(a) for a in query.atoms())
+
+    def _engine_literal(self, atom: Atom) -> engine.Literal:
+        return _engine_literal(atom, self._symbols)
+
+    def _engine_row(self, atom: Atom) -> engine.Row:
+        return tuple(
+            self._engine_value(atom.get_arg(k)) for k in atom.relation().arity()
+        )
+
+    def _engine_value(self, term: Term) -> engine.Value:
+        return _engine_value(term, self._symbols)
+
+
+class Backend(metaclass=ABCMeta):
+    @abstractmethod
+    def name(self) -> str:
+        ...
+
+    # One list of raw Goal rows per query, in the order of the query's arity,
+    # with at most limit rows each if a limit is given
+    @abstractmethod
+    def run(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        ...
+
+    async def run_async(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        return await asyncio.to_thread(self.run, program, queries, limit)
+
+
+class SouffleInterpretedBackend(Backend):
+    _piped: bool
+
+    def __init__(self, piped: bool = False):
+        self._piped = piped
+
+    @override
+    def name(self) -> str:
+        return "souffle-piped" if self._piped else "souffle-interpreted"
+
+    @override
+    def run(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        run = souffle.run_piped if self._piped else souffle.run
+        output = run(
+            self._program(program, queries, limit),
+            fact_dirname=program._fact_dirname(),
+        )
+        return [output.facts[q.name()] for q in queries]
+
+    @override
+    async def run_async(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        output = await souffle.run_async(
+            self._program(program, queries, limit),
+            fact_dirname=await asyncio.to_thread(program._fact_dirname),
+            piped=self._piped,
+        )
+        return [output.facts[q.name()] for q in queries]
+
+    @staticmethod
+    def _program(
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int],
+    ) -> str:
+        relations, _ = program.slice(queries)
+        return program._souffle_dl_repr(queries, relations, limit)
+
+
+class SouffleCompiledBackend(Backend):
+    @override
+    def name(self) -> str:
+        return "souffle-compiled"
+
+    @override
+    def run(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        binary_filename, relations, param_atoms = self._prepare(program, queries, limit)
+        with self._fact_dirname(program, relations, param_atoms) as fact_dirname:
+            output = souffle.run_compiled(binary_filename, fact_dirname)
+        return [output.facts[q.name()] for q in queries]
+
+    @override
+    async def run_async(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        binary_filename, relations, param_atoms = await asyncio.to_thread(
+            self._prepare, program, queries, limit
+        )
+        with self._fact_dirname(program, relations, param_atoms) as fact_dirname:
+            output = await souffle.run_compiled_async(binary_filename, fact_dirname)
+        return [output.facts[q.name()] for q in queries]
+
+    # The limit is part of the program text, so each limit gets its own binary
+    def _prepare(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int],
+    ) -> tuple[str, list[Relation], list[Atom]]:
+        parameterized = [q.parameterized() for q in queries]
+        templates = [template for template, _ in parameterized]
+        param_atoms = [a for _, a in parameterized if a is not None]
+        _, idbs = program.slice(queries)
+        relations = self._input_relations(idbs, templates)
+
+        dl_prog = program._souffle_dl_repr(templates, relations, limit)
+
+        binary_filename = souffle.compile(dl_prog)
+
+        # Materializes the shared fact directory too
+        program._fact_dirname()
+
+        return binary_filename, relations, param_atoms
+
+    # Only the Param facts change between queries, so every other input is
+    # linked from the shared fact directory
+    @staticmethod
+    @contextlib.contextmanager
+    def _fact_dirname(
+        program: DatalogProgram,
+        relations: list[Relation],
+        param_atoms: list[Atom],
+    ) -> Iterator[str]:
+        shared_dirname = program._fact_dirname()
+        with tempfile.TemporaryDirectory() as fact_dirname:
+            for r in relations:
+                filename = f"{r.name()}.facts"
+                if os.path.exists(f"{shared_dirname}/{filename}"):
+                    os.symlink(
+                        f"{shared_dirname}/{filename}",
+                        f"{fact_dirname}/{filename}",
+                    )
+            program._write_facts(
+                fact_dirname,
+                [a.relation() for a in param_atoms],
+                {a.relation(): [a] for a in param_atoms},
+            )
+            yield fact_dirname
+
+    # Every relation the rules and the queries mention, in a fixed order that
+    # depends only on the rules and the shape of the queries
+    @staticmethod
+    def _input_relations(
+        idbs: list[NamedRule],
+        queries: list[Query],
+    ) -> list[Relation]:
+        relations: dict[Relation, None] = {}
+
+        def add(r: Relation) -> None:
+            if not r.infix_symbol():
+                relations[r] = None
+
+        for idb in idbs:
+            add(idb.rule().head().relation())
+            for a in idb.rule().body():
+                add(a.relation())
+
+        for query in queries:
+            for a in query.atoms():
+                add(a.relation())
+
+        return list(relations)
+
+
+class InProcessBackend(Backend):
+    @override
+    def name(self) -> str:
+        return "in-process"
+
+    # With magic sets, each batch is evaluated from scratch over its rewrite
+    # instead of over the program's shared materialization
+    @override
+    def run(
+        self,
+        program: DatalogProgram,
+        queries: list[Query],
+        limit: Optional[int] = None,
+    ) -> list[list[Row]]:
+        if program.magic_sets():
+            rw = program.magic_rewrite(queries)
+            e = engine.Engine(rw.clauses)
+            program._add_edbs(e)
+            bodies = rw.queries
+        else:
+            e = program._materialized()
+            bodies = [program._engine_body(q) for q in queries]
+
+        return [
+            [
+                tuple(str(v) for v in row)
+                for row in e.query(
+                    body=body,
+                    head=q.relation().arity().keys(),
+                    limit=limit,
+                )
+            ]
+            for q, body in zip(queries, bodies)
+        ]
+
+
+BACKENDS: dict[str, Callable[[], Backend]] = {
+    "souffle-interpreted": SouffleInterpretedBackend,
+    "souffle-piped": lambda: SouffleInterpretedBackend(piped=True),
+    "souffle-compiled": SouffleCompiledBackend,
+    "in-process": InProcessBackend,
+}
+
+
+def get_backend(name: Optional[str] = None) -> Backend:
+    if name is None:
+        name = os.environ.get("CEA_BACKEND", "souffle-interpreted")
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown backend {name} (expected one of {', '.join(BACKENDS)})"
+        )
+    return BACKENDS[name]()
+
+
+# Evaluates queries against independent programs in parallel; Souffle backends
+# run one process per worker, while in-process work shares the interpreter
+def run_many(
+    jobs: list[tuple[DatalogProgram, Query]],
+    max_workers: Optional[int] = None,
+) -> list[list[Assignment]]:
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or os.cpu_count()
+    ) as executor:
+        return list(executor.map(lambda job: job[0].run_query(job[1]), jobs))
+
+
+def _interned(sort: Sort) -> bool:
+    return sort.dl_repr() == "symbol"
+
+
+def _fact_rows(query: Query, assignments: list[Assignment]) -> list[Row]:
+    keys = list(query.relation().arity())
+    return [tuple(a[k].fact_repr() for k in keys) for a in assignments]
+
+
+def _parse_fact_rows(query: Query, rows: list[Row]) -> list[Assignment]:
+    arity = list(query.relation().arity().items())
+    return [
+        {key: key_sort.parse(val) for (key, key_sort), val in zip(arity, row)}
+        for row in rows
+    ]
+
+
+def _engine_clause(rule: Rule, symbols: SymbolTable) -> engine.Clause:
+    return engine.Clause(
+        head=_engine_literal(rule.head(), symbols),
+        body=tuple(_engine_literal(a, symbols) for a in rule.body()),
+    )
+
+
+def _engine_literal(atom: Atom, symbols: SymbolTable) -> engine.Literal:
+    args: list[engine.Arg] = []
+    for k in atom.relation().arity():
+        term = atom.get_arg(k)
+        if term.ground():
+            args.append(_engine_value(term, symbols))
+        else:
+            args.append(engine.Variable(term.dl_repr()))
+    return engine.Literal(
+        relation=atom.relation().name(),
+        args=tuple(args),
+        infix_symbol=atom.relation().infix_symbol(),
+    )
+
+
+def _engine_value(term: Term, symbols: SymbolTable) -> engine.Value:
+    if _interned(term.sort()):
+        return symbols.encode(term)
+    if term.sort().dl_repr() == "number":
+        return int(term.fact_repr())
+    return term.fact_repr()
+
+
+def _variable_sorts(rule: Rule) -> dict[str, Sort]:
+    return {
+        v.dl_repr(): v.sort()
+        for a in [rule.head()] + rule.body()
+        for v in a.free_variables()
+    }
@@ -282,19 +282,67 @@ class CLIInteractor(Interactor):
                 assert_never(unreachable)
 
 
+class AsyncInteractor(metaclass=ABCMeta):
+    @abstractmethod
+    async def display_tree(self, derivation_tree: Tree) -> None:
+        ...
+
+    @abstractmethod
+    async def select_goal(self, goals: list[PathedAtom]) -> PathedAtom:
+        ...
+
+    @abstractmethod
+    async def select_rule(
+        self, rules: list[tuple[NamedRule, list[Assignment]]]
+    ) -> tuple[NamedRule, list[Assignment]]:
+        ...
+
+    @abstractmethod
+    async def select_assignment(self, assignments: list[Assignment]) -> Assignment:
+        ...
+
+
 # Construction algorithm
 
 
+# Builds the whole derivation tree of a ground goal from the provenance of a
+# single evaluation, or returns None if the goal is not derivable
+def explain(program: DatalogProgram, goal: Atom) -> Optional[Tree]:
+    if not program.is_edb(goal) and program.provenance(goal) is None:
+        return None
+
+    def go(atom: Atom) -> Tree:
+        p = program.provenance(atom)
+        if p is None:
+            return Leaf(atom)
+        named_rule, assignment = p
+        dependencies = named_rule.rule().substitute_dependencies(assignment)
+        return Step(
+            label=named_rule.label(),
+            consequent=atom,
+            antecedents=OrderedDict((k, go(a)) for k, a in dependencies.items()),
+        )
+
+    return go(goal)
+
+
 class Constructor:
     _base_program: DatalogProgram
+    _interactor: Interactor | AsyncInteractor
 
-    def __init__(self, base_program: DatalogProgram, interactor: Interactor):
+    def __init__(
+        self,
+        base_program: DatalogProgram,
+        interactor: Interactor | AsyncInteractor,
+    ):
         self._base_program = base_program
         self._interactor = interactor
 
     def construct(self, initial_goal: Atom) -> Tree:
+        if not isinstance(self._interactor, Interactor):
+            raise ValueError("Use construct_async with an asynchronous interactor")
+
         dt: Tree = Goal(goal=initial_goal)
-        rules = self._base_program.idbs()
         while True:
             self._interactor.display_tree(dt)
 
@@ -303,47 +351,160 @@ class Constructor:
                 return dt
 
             goal_atom, goal_bc = self._interactor.select_goal(subgoals)
+            rules = self._base_program.idbs_for(goal_atom.relation())
 
             selected_rule, possible_assignments = self._interactor.select_rule(
-                [(r, self._rule_options(goal_atom, r)) for r in rules]
+                self._rules_options(goal_atom, rules)
             )
 
             selected_assignment = self._interactor.select_assignment(
                 possible_assignments
             )
 
-            dt = dt.replace(
-                goal_bc,
-                Step(
-                    label=selected_rule.label(),
-                    consequent=goal_atom,
-                    antecedents=OrderedDict(
-                        (k, self._make_leaf(a.substitute_all(selected_assignment)))
-                        for k, a in selected_rule.rule().dependencies().items()
-                    ),
-                ),
+            dt = self._expand(
+                dt, goal_atom, goal_bc, selected_rule, selected_assignment
             )
 
-    def _rule_options(self, goal: Atom, named_rule: NamedRule) -> list[Assignment]:
+    async def construct_async(self, initial_goal: Atom) -> Tree:
+        if not isinstance(self._interactor, AsyncInteractor):
+            raise ValueError("Use construct with a synchronous interactor")
+
+        dt: Tree = Goal(goal=initial_goal)
+        while True:
+            await self._interactor.display_tree(dt)
+
+            subgoals = dt.goals()
+            if not subgoals:
+                return dt
+
+            goal_atom, goal_bc = await self._interactor.select_goal(subgoals)
+            rules = self._base_program.idbs_for(goal_atom.relation())
+
+            queries = self._rule_queries(goal_atom, rules)
+            results = await self._base_program.run_queries_async(list(queries.values()))
+
+            selected_rule, possible_assignments = await self._interactor.select_rule(
+                self._split_options(rules, queries, results)
+            )
+
+            selected_assignment = await self._interactor.select_assignment(
+                possible_assignments
+            )
+
+            dt = self._expand(
+                dt, goal_atom, goal_bc, selected_rule, selected_assignment
+            )
+
+    def _expand(
+        self,
+        dt: Tree,
+        goal_atom: Atom,
+        goal_bc: Breadcrumbs,
+        selected_rule: NamedRule,
+        selected_assignment: Assignment,
+    ) -> Tree:
+        dependencies = selected_rule.rule().substitute_dependencies(selected_assignment)
+        return dt.replace(
+            goal_bc,
+            Step(
+                label=selected_rule.label(),
+                consequent=goal_atom,
+                antecedents=OrderedDict(
+                    (k, self._make_leaf(a)) for k, a in dependencies.items()
+                ),
+            ),
+        )
+
+    # Asks for the options of every candidate rule in one engine invocation
+    def _rules_options(
+        self,
+        goal: Atom,
+        named_rules: list[NamedRule],
+    ) -> list[tuple[NamedRule, list[Assignment]]]:
+        queries = self._rule_queries(goal, named_rules)
+        results = self._base_program.run_queries(list(queries.values()))
+        return self._split_options(named_rules, queries, results)
+
+    def _rule_queries(
+        self,
+        goal: Atom,
+        named_rules: list[NamedRule],
+    ) -> dict[int, Query]:
+        queries: dict[int, Query] = {}
+        for i, r in enumerate(named_rules):
+            query = self._rule_query(goal, r, name=f"Goal{i}")
+            if query:
+                queries[i] = query
+        return queries
+
+    @staticmethod
+    def _split_options(
+        named_rules: list[NamedRule],
+        queries: dict[int, Query],
+        results: list[list[Assignment]],
+    ) -> list[tuple[NamedRule, list[Assignment]]]:
+        by_index = dict(zip(queries.keys(), results))
+        return [(r, by_index.get(i, [])) for i, r in enumerate(named_rules)]
+
+    def _rule_query(
+        self,
+        goal: Atom,
+        named_rule: NamedRule,
+        name: str = "Goal",
+    ) -> Optional[Query]:
         rule = named_rule.rule()
 
         if rule.head().relation() != goal.relation():
-            return []
-
-        def make_substitutions(atom: Atom) -> Atom:
-            new_atom = atom
-            for k in rule.head().relation().arity():
-                lhs = rule.head().get_arg(k)
-                assert isinstance(lhs, Var)
-                rhs = goal.get_arg(k)
-                new_atom = new_atom.substitute(lhs.dl_repr(), rhs)
-            return new_atom
+            return None
+
+        assignment: Assignment = {}
+        for k in rule.head().relation().arity():
+            lhs = rule.head().get_arg(k)
+            assert isinstance(lhs, Var)
+            assignment[lhs.dl_repr()] = goal.get_arg(k)
+
+        body = rule.substitute_body(assignment)
+        if self._contradicts(body):
+            return None
+        dependencies = body[: len(rule.dependencies())]
+
+        # Only the dependencies' variables are read when expanding the goal
+        return Query(
+            body,
+            name=name,
+            variables=[fv.dl_repr() for a in dependencies for fv in a.free_variables()],
+        )
 
-        query = Query([make_substitutions(a) for a in rule.body()])
-        return self._base_program.run_query(query=query)
+    # Propagates the constants of '=' checks and evaluates the checks that
+    # become ground, so rules whose checks contradict the goal are pruned
+    # without an engine invocation
+    def _contradicts(self, body: list[Atom]) -> bool:
+        remaining = [a for a in body if a.relation().infix_symbol()]
+        assignment: Assignment = {}
+        while True:
+            pending = []
+            progress = False
+            for check in remaining:
+                check = check.substitute_all(assignment)
+                lhs, rhs = (check.get_arg(k) for k in check.relation().arity())
+                if lhs.ground() and rhs.ground():
+                    if not self._base_program.holds(check):
+                        return True
+                elif check.relation().infix_symbol() == "=" and (
+                    lhs.ground() or rhs.ground()
+                ):
+                    var, value = (rhs, lhs) if lhs.ground() else (lhs, rhs)
+                    assert isinstance(var, Var)
+                    assignment[var.dl_repr()] = value
+                    progress = True
+                else:
+                    pending.append(check)
+            if not progress:
+                return False
+            remaining = pending
 
     def _make_leaf(self, atom: Atom) -> Tree:
-        if atom in self._base_program.edbs():
+        if self._base_program.is_edb(atom):
             return Leaf(atom)
         else:
             return Goal(atom)
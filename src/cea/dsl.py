@@ -1,47 +1,115 @@
+from typing import Optional
+
 from . import derivation as der
 from . import framework as fw
 from . import stdbiolib
+from .cache import ResultCache
 
 FlexibleTerm = int | fw.Term
 
 
 class Program:
     _trace: dict[fw.Metadata, object]
-    _library: fw.Library
-
-    def __init__(self, *libraries: fw.Library) -> None:
-        if stdbiolib.lib not in libraries:
-            libraries += (stdbiolib.lib,)
+    _library: fw.CompiledLibrary
+    _backend: fw.Backend
+    _cache: Optional[ResultCache]
+    _dl_prog: Optional[fw.DatalogProgram]
+
+    # A compiled library (say, loaded from disk) is used as it is, without
+    # adding the standard library
+    def __init__(
+        self,
+        *libraries: fw.Library | fw.CompiledLibrary,
+        backend: Optional[fw.Backend | str] = None,
+        cache: Optional[ResultCache] = None,
+    ) -> None:
+        if len(libraries) == 1 and isinstance(libraries[0], fw.CompiledLibrary):
+            self._library = libraries[0]
+        else:
+            plain = tuple(lib for lib in libraries if isinstance(lib, fw.Library))
+            if len(plain) != len(libraries):
+                raise ValueError("Cannot merge a compiled library")
+            if stdbiolib.lib not in plain:
+                plain += (stdbiolib.lib,)
+            # A single library keeps its compilation; merging makes a new one
+            merged = plain[0] if len(plain) == 1 else fw.Library.merge(plain)
+            self._library = merged.compile()
 
         self._trace = {}
-        self._library = fw.Library.merge(libraries)
+        self._backend = (
+            backend if isinstance(backend, fw.Backend) else fw.get_backend(backend)
+        )
+        self._cache = cache
+        self._dl_prog = None
 
     def do(self, m: fw.Metadata, d: object) -> None:
         assert m._parent == d._parent  # type: ignore
         self._trace[m] = d
+        if self._dl_prog is not None:
+            self._dl_prog.add_edbs([m])
 
-    def query(self, m: fw.Metadata) -> None:
-        dl_prog = fw.DatalogProgram(
-            edbs=list(self._trace.keys()),
-            idbs=self._library.rules(),
-        )
-        if dl_prog.run_query(query=fw.Query([m])):
-            print(">>> Possible! <<<")
-
-            dt = der.Constructor(
-                base_program=dl_prog,
-                interactor=der.CLIInteractor(
-                    goal_mode=der.CLIInteractor.Mode.AUTO,
-                    rule_mode=der.CLIInteractor.Mode.FAST_FORWARD,
-                ),
-            ).construct(initial_goal=m)
-
-            output_program = self._construct_output_program(derivation_tree=dt)
-
-            print(f"\n## OUTPUT PROGRAM\n\n{output_program}")
+    # Without interaction, the derivation tree is read off the provenance of a
+    # single evaluation instead of being constructed step by step
+    def query(self, m: fw.Metadata, interactive: bool = True) -> None:
+        dl_prog = self._datalog_program()
 
+        explained: Optional[der.Tree] = None
+        if interactive:
+            possible = dl_prog.exists(fw.Query([m]))
         else:
+            explained = der.explain(dl_prog, m)
+            possible = explained is not None
+
+        if not possible:
             print(">>> Not possible! <<<")
+            return
+
+        print(">>> Possible! <<<")
+
+        dt = explained or der.Constructor(
+            base_program=dl_prog,
+            interactor=der.CLIInteractor(
+                goal_mode=der.CLIInteractor.Mode.AUTO,
+                rule_mode=der.CLIInteractor.Mode.FAST_FORWARD,
+            ),
+        ).construct(initial_goal=m)
+
+        output_program = self._construct_output_program(derivation_tree=dt)
+
+        print(f"\n## OUTPUT PROGRAM\n\n{output_program}")
+
+    # Every fact of the given classes that the trace supports, found with a
+    # single batched evaluation rather than one query per candidate
+    def derivable(
+        self,
+        *classes: type[fw.Metadata],
+    ) -> dict[type[fw.Metadata], list[fw.Metadata]]:
+        patterns = [cls.free("") for cls in classes]
+        results = self._datalog_program().run_queries(
+            [fw.Query([p], name=f"Goal_{p.relation().name()}") for p in patterns]
+        )
+
+        ret: dict[type[fw.Metadata], list[fw.Metadata]] = {}
+        for cls, p, assignments in zip(classes, patterns, results):
+            facts = []
+            for assignment in assignments:
+                m = p.substitute_all(assignment)
+                assert isinstance(m, fw.Metadata)
+                facts.append(m)
+            ret[cls] = sorted(facts, key=lambda m: m.unparse())
+        return ret
+
+    # Built on the first query and extended by every later event, so its
+    # materialization only ever propagates what changed
+    def _datalog_program(self) -> fw.DatalogProgram:
+        if self._dl_prog is None:
+            self._dl_prog = fw.DatalogProgram(
+                edbs=list(self._trace.keys()),
+                idbs=self._library,
+                backend=self._backend,
+                cache=self._cache,
+            )
+        return self._dl_prog
 
     def _construct_output_program(self, derivation_tree: der.Tree) -> str:
         initializations = []
@@ -0,0 +1,389 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+###############################################################################
+# Syntax
+
+Value = int | str
+Row = tuple[Value, ...]
+
+
+@dataclass(frozen=True)
+class Variable:
+    name: str
+
+
+Arg = Variable | int | str
+
+
+def _arg_dl_repr(arg: Arg) -> str:
+    if isinstance(arg, Variable):
+        return arg.name
+    if isinstance(arg, int):
+        return str(arg)
+    return '"' + arg + '"'
+
+
+@dataclass(frozen=True)
+class Literal:
+    relation: str
+    args: tuple[Arg, ...]
+    infix_symbol: Optional[str] = None
+
+    def dl_repr(self) -> str:
+        args = [_arg_dl_repr(arg) for arg in self.args]
+        if self.infix_symbol:
+            lhs, rhs = args
+            return f"{lhs} {self.infix_symbol} {rhs}"
+        return f"{self.relation}({', '.join(args)})"
+
+
+@dataclass(frozen=True)
+class Clause:
+    head: Literal
+    body: tuple[Literal, ...]
+
+    def dl_repr(self) -> str:
+        if not self.body:
+            return self.head.dl_repr() + "."
+        rhs = ",\n  ".join([lit.dl_repr() for lit in self.body]) + "."
+        return f"{self.head.dl_repr()} :-\n  {rhs}"
+
+
+###############################################################################
+# Storage
+
+
+class Table:
+    _rows: set[Row]
+    _indexes: dict[tuple[int, ...], dict[Row, list[Row]]]
+
+    def __init__(self) -> None:
+        self._rows = set()
+        self._indexes = {}
+
+    def __contains__(self, row: Row) -> bool:
+        return row in self._rows
+
+    def __iter__(self) -> Iterator[Row]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: Row) -> bool:
+        if row in self._rows:
+            return False
+        self._rows.add(row)
+        for positions, index in self._indexes.items():
+            key = tuple(row[i] for i in positions)
+            index.setdefault(key, []).append(row)
+        return True
+
+    def lookup(self, positions: tuple[int, ...], key: Row) -> Iterable[Row]:
+        if not positions:
+            return self._rows
+        index = self._indexes.get(positions)
+        if index is None:
+            index = {}
+            for row in self._rows:
+                index.setdefault(tuple(row[i] for i in positions), []).append(row)
+            self._indexes[positions] = index
+        return index.get(key, ())
+
+
+###############################################################################
+# Evaluation plans
+
+Binding = dict[str, Value]
+
+_FULL = 0
+_DELTA = 1
+_OLD = 2
+
+
+@dataclass(frozen=True)
+class _Scan:
+    relation: str
+    source: int
+    key_positions: tuple[int, ...]
+    key_args: tuple[Arg, ...]
+    binds: tuple[tuple[int, str], ...]
+    repeats: tuple[tuple[int, int], ...]
+
+
+@dataclass(frozen=True)
+class _Check:
+    infix_symbol: str
+    lhs: Arg
+    rhs: Arg
+    binds: Optional[str]
+
+
+_Step = _Scan | _Check
+
+
+def _value(arg: Arg, binding: Binding) -> Value:
+    if isinstance(arg, Variable):
+        return binding[arg.name]
+    return arg
+
+
+def _plan(body: tuple[Literal, ...], delta_index: Optional[int]) -> list[_Step]:
+    bound: set[str] = set()
+    steps: list[_Step] = []
+    pending = [lit for lit in body if lit.infix_symbol]
+
+    def is_bound(arg: Arg) -> bool:
+        return not isinstance(arg, Variable) or arg.name in bound
+
+    def schedule_checks() -> None:
+        progress = True
+        while progress:
+            progress = False
+            for lit in list(pending):
+                assert lit.infix_symbol
+                lhs, rhs = lit.args
+                binds = None
+                if not (is_bound(lhs) and is_bound(rhs)):
+                    if lit.infix_symbol != "=":
+                        continue
+                    if is_bound(lhs):
+                        lhs, rhs = rhs, lhs
+                    if not is_bound(rhs):
+                        continue
+                    assert isinstance(lhs, Variable)
+                    binds = lhs.name
+                    bound.add(binds)
+                steps.append(_Check(lit.infix_symbol, lhs, rhs, binds))
+                pending.remove(lit)
+                progress = True
+
+    schedule_checks()
+
+    relational = [lit for lit in body if not lit.infix_symbol]
+    for i, lit in enumerate(relational):
+        if delta_index is None:
+            source = _FULL
+        elif i < delta_index:
+            source = _OLD
+        elif i == delta_index:
+            source = _DELTA
+        else:
+            source = _FULL
+
+        key_positions = []
+        key_args = []
+        binds = []
+        repeats = []
+        first_seen: dict[str, int] = {}
+        for pos, arg in enumerate(lit.args):
+            if is_bound(arg):
+                key_positions.append(pos)
+                key_args.append(arg)
+            else:
+                assert isinstance(arg, Variable)
+                if arg.name in first_seen:
+                    repeats.append((pos, first_seen[arg.name]))
+                else:
+                    first_seen[arg.name] = pos
+                    binds.append((pos, arg.name))
+        bound.update(first_seen)
+
+        steps.append(
+            _Scan(
+                relation=lit.relation,
+                source=source,
+                key_positions=tuple(key_positions),
+                key_args=tuple(key_args),
+                binds=tuple(binds),
+                repeats=tuple(repeats),
+            )
+        )
+
+        schedule_checks()
+
+    if pending:
+        raise ValueError("Unbound variable in infix check")
+
+    return steps
+
+
+def _relational_count(body: tuple[Literal, ...]) -> int:
+    return sum(1 for lit in body if not lit.infix_symbol)
+
+
+###############################################################################
+# Engine
+
+
+class Engine:
+    _clauses: list[Clause]
+    _delta_plans: list[list[tuple[str, list[_Step]]]]
+    _tables: dict[str, Table]
+    _pending: dict[str, Table]
+    _initialized: bool
+    _provenance: Optional[dict[tuple[str, Row], tuple[int, Binding]]]
+
+    def __init__(self, clauses: Iterable[Clause], provenance: bool = False):
+        self._clauses = list(clauses)
+        self._delta_plans = []
+        for clause in self._clauses:
+            relational = [lit for lit in clause.body if not lit.infix_symbol]
+            plans = []
+            for i, lit in enumerate(relational):
+                plan = _plan(clause.body, delta_index=i)
+                self._check_head(clause, plan)
+                plans.append((lit.relation, plan))
+            self._delta_plans.append(plans)
+        self._tables = {}
+        self._pending = {}
+        self._initialized = False
+        self._provenance = {} if provenance else None
+
+    def table(self, relation: str) -> Table:
+        if relation not in self._tables:
+            self._tables[relation] = Table()
+        return self._tables[relation]
+
+    def add(self, relation: str, rows: Iterable[Row]) -> None:
+        table = self.table(relation)
+        for row in rows:
+            if table.add(row):
+                self._pending.setdefault(relation, Table()).add(row)
+
+    # Semi-naive evaluation to a fixpoint, starting from the facts added since
+    # the last run
+    def run(self) -> None:
+        delta = self._pending
+        self._pending = {}
+
+        if not self._initialized:
+            self._initialized = True
+            for i, clause in enumerate(self._clauses):
+                if _relational_count(clause.body) == 0:
+                    plan = _plan(clause.body, delta_index=None)
+                    self._check_head(clause, plan)
+                    self._derive(i, self._execute(plan, {}), delta)
+
+        while delta:
+            new: dict[str, Table] = {}
+            for i, plans in enumerate(self._delta_plans):
+                for relation, plan in plans:
+                    if relation not in delta:
+                        continue
+                    self._derive(i, self._execute(plan, delta), new)
+            delta = new
+
+    # The index of the clause that first derived the row and the binding of its
+    # variables, or None if the row was added directly (or not derived at all).
+    # Every row in the binding's body was derived (or added) strictly earlier,
+    # so following provenance never loops.
+    def provenance(self, relation: str, row: Row) -> Optional[tuple[int, Binding]]:
+        if self._provenance is None:
+            raise ValueError("Engine does not record provenance")
+        self.run()
+        return self._provenance.get((relation, row))
+
+    def query(
+        self,
+        body: Iterable[Literal],
+        head: Iterable[str],
+        limit: Optional[int] = None,
+    ) -> list[Row]:
+        self.run()
+        plan = _plan(tuple(body), delta_index=None)
+        head = list(head)
+        seen: set[Row] = set()
+        ret = []
+        for binding in self._execute(plan, {}):
+            row = tuple(binding[name] for name in head)
+            if row in seen:
+                continue
+            seen.add(row)
+            ret.append(row)
+            if limit is not None and len(ret) >= limit:
+                break
+        return ret
+
+    @staticmethod
+    def _check_head(clause: Clause, plan: list[_Step]) -> None:
+        bound: set[str] = set()
+        for step in plan:
+            if isinstance(step, _Scan):
+                bound.update(name for _, name in step.binds)
+            elif step.binds:
+                bound.add(step.binds)
+        for arg in clause.head.args:
+            if isinstance(arg, Variable) and arg.name not in bound:
+                raise ValueError(f"Unbound head variable {arg.name}")
+
+    # Rows are materialized before insertion since the plan may be scanning the
+    # head's own table
+    def _derive(
+        self,
+        clause_index: int,
+        bindings: Iterator[Binding],
+        new: dict[str, Table],
+    ) -> None:
+        head = self._clauses[clause_index].head
+        derived = [(tuple(_value(arg, b) for arg in head.args), b) for b in bindings]
+        table = self.table(head.relation)
+        for row, binding in derived:
+            if table.add(row):
+                new.setdefault(head.relation, Table()).add(row)
+                if self._provenance is not None:
+                    self._provenance[head.relation, row] = (clause_index, binding)
+
+    def _execute(
+        self,
+        plan: list[_Step],
+        delta: dict[str, Table],
+    ) -> Iterator[Binding]:
+        def go(i: int, binding: Binding) -> Iterator[Binding]:
+            if i == len(plan):
+                yield binding
+                return
+
+            step = plan[i]
+
+            if isinstance(step, _Check):
+                rhs = _value(step.rhs, binding)
+                if step.binds:
+                    yield from go(i + 1, {**binding, step.binds: rhs})
+                    return
+                lhs = _value(step.lhs, binding)
+                if step.infix_symbol == "=":
+                    ok = lhs == rhs
+                elif step.infix_symbol == "<":
+                    ok = lhs < rhs  # type: ignore[operator]
+                else:
+                    raise ValueError(f"Unknown infix symbol {step.infix_symbol}")
+                if ok:
+                    yield from go(i + 1, binding)
+                return
+
+            key = tuple(_value(arg, binding) for arg in step.key_args)
+            delta_table = delta.get(step.relation)
+            if step.source == _DELTA:
+                if delta_table is None:
+                    return
+                rows = delta_table.lookup(step.key_positions, key)
+            else:
+                rows = self.table(step.relation).lookup(step.key_positions, key)
+
+            for row in rows:
+                if (
+                    step.source == _OLD
+                    and delta_table is not None
+                    and row in delta_table
+                ):
+                    continue
+                if any(row[pos] != row[first] for pos, first in step.repeats):
+                    continue
+                new_binding = binding.copy()
+                for pos, name in step.binds:
+                    new_binding[name] = row[pos]
+                yield from go(i + 1, new_binding)
+
+        return go(0, {})
@@ -0,0 +1,267 @@
+from typing import IO, Callable, Iterable, Optional, Protocol, Sequence
+
+import hashlib
+import threading
+
+import numpy as np
+import numpy.typing as npt
+
+from .core import Atom, Relation, Sort, Term
+
+Column = npt.NDArray[np.int64]
+Table = npt.NDArray[np.int64]
+
+# Maps a symbol (as written in fact files) of a sort to the value an engine
+# should see for it
+SymbolEncoder = Callable[[Sort, str], int]
+
+
+class AtomClass(Protocol):
+    def __call__(self, **kwargs: Term) -> Atom:
+        ...
+
+    def class_relation(self) -> Relation:
+        ...
+
+
+def _is_symbol(sort: Sort) -> bool:
+    return sort.dl_repr() == "symbol"
+
+
+# Facts stored column-wise per relation rather than as one atom per fact:
+# numbers as they are and symbols as codes into a dictionary per sort. Rows are
+# appended in bulk and deduplicated (and sorted) lazily, on the first read
+# after an append.
+class FactStore:
+    _classes: dict[Relation, AtomClass]
+    _tables: dict[Relation, Table]
+    _chunks: dict[Relation, list[Table]]
+    _row_sets: dict[Relation, set[tuple[int, ...]]]
+    _codes: dict[Sort, dict[str, int]]
+    _strings: dict[Sort, list[str]]
+    _lock: threading.RLock
+
+    def __init__(self) -> None:
+        self._classes = {}
+        self._tables = {}
+        self._chunks = {}
+        self._row_sets = {}
+        self._codes = {}
+        self._strings = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return sum(len(self._table(r)) for r in self.relations())
+
+    # One sequence of values per argument of the class's relation: numbers for
+    # number sorts and fact representations (like Term.fact_repr) otherwise
+    def append(
+        self,
+        cls: AtomClass,
+        **columns: Sequence[int] | Sequence[str] | npt.ArrayLike,
+    ) -> None:
+        relation = cls.class_relation()
+        arity = relation.arity()
+        if relation.infix_symbol():
+            raise ValueError("Cannot store infix relation")
+        if not arity:
+            raise ValueError("Cannot store nullary relation")
+        if columns.keys() != arity.keys():
+            raise ValueError(
+                f"Expected columns {', '.join(arity)} for {relation.name()}"
+            )
+
+        with self._lock:
+            coded = [self._encode(sort, columns[k]) for k, sort in arity.items()]
+            if len({len(c) for c in coded}) != 1:
+                raise ValueError("Columns differ in length")
+            self._classes[relation] = cls
+            self._chunks.setdefault(relation, []).append(np.stack(coded, axis=1))
+
+    def extend(self, atoms: Iterable[Atom]) -> None:
+        groups: dict[Relation, list[Atom]] = {}
+        for atom in atoms:
+            if not hasattr(type(atom), "class_relation"):
+                raise ValueError("Can only store atoms of Metadata classes")
+            if not atom.ground():
+                raise ValueError("Non-ground fact")
+            groups.setdefault(atom.relation(), []).append(atom)
+
+        for relation, group in groups.items():
+            cls: AtomClass = type(group[0])  # type: ignore[assignment]
+            self.append(
+                cls,
+                **{
+                    k: [_raw(a.get_arg(k)) for a in group]
+                    for k, sort in relation.arity().items()
+                },
+            )
+
+    def relations(self) -> list[Relation]:
+        with self._lock:
+            return list(self._classes)
+
+    # The distinct symbols of each sort, indexed by their codes
+    def symbols(self) -> dict[Sort, list[str]]:
+        with self._lock:
+            return {sort: list(strings) for sort, strings in self._strings.items()}
+
+    # Deduplicated rows, one column per argument, with symbols as codes
+    def columns(self, relation: Relation) -> list[Column]:
+        table = self._table(relation)
+        return [table[:, i] for i in range(table.shape[1])]
+
+    # Like columns, but with symbols encoded for an engine
+    def values(self, relation: Relation, encode: SymbolEncoder) -> list[Column]:
+        ret = []
+        for (k, sort), column in zip(
+            relation.arity().items(),
+            self.columns(relation),
+        ):
+            if _is_symbol(sort):
+                remap = np.array(
+                    [encode(sort, s) for s in self._strings.get(sort, [])],
+                    dtype=np.int64,
+                )
+                column = remap[column]
+            ret.append(column)
+        return ret
+
+    def write_facts(
+        self,
+        f: IO[str],
+        relation: Relation,
+        encode: SymbolEncoder,
+    ) -> None:
+        values = self.values(relation, encode)
+        if values and len(values[0]):
+            np.savetxt(f, np.stack(values, axis=1), fmt="%d", delimiter="\t")
+
+    def contains(self, atom: Atom) -> bool:
+        relation = atom.relation()
+        if relation not in self._classes:
+            return False
+        row = self._code_row(relation, {k: atom.get_arg(k) for k in relation.arity()})
+        if row is None:
+            return False
+        with self._lock:
+            if relation not in self._row_sets:
+                self._row_sets[relation] = set(
+                    map(tuple, self._table(relation).tolist())
+                )
+            return row in self._row_sets[relation]
+
+    # The facts of the relation with the given arguments
+    def matching(self, relation: Relation, **args: Term) -> list[Atom]:
+        if relation not in self._classes:
+            return []
+        if not args.keys() <= relation.arity().keys():
+            raise ValueError(f"Unknown arguments for relation {relation.name()}")
+        codes = self._code_row(relation, args)
+        if codes is None:
+            return []
+
+        table = self._table(relation)
+        positions = {k: i for i, k in enumerate(relation.arity())}
+        mask = np.ones(len(table), dtype=bool)
+        for k, code in zip(args, codes):
+            mask &= table[:, positions[k]] == code
+        return self._atoms(relation, table[mask])
+
+    # Materializes the facts (of every relation if none is given)
+    def atoms(self, relation: Optional[Relation] = None) -> list[Atom]:
+        if relation is None:
+            return [a for r in self.relations() for a in self.atoms(r)]
+        if relation not in self._classes:
+            return []
+        return self._atoms(relation, self._table(relation))
+
+    # Independent of the order (and multiplicity) of appends
+    def fingerprint(self) -> str:
+        h = hashlib.sha256()
+        with self._lock:
+            ranks = {
+                sort: np.argsort(np.argsort(np.array(strings, dtype=str)))
+                for sort, strings in self._strings.items()
+            }
+            for relation in sorted(self._classes, key=lambda r: r.name()):
+                table = self._table(relation).copy()
+                for i, sort in enumerate(relation.arity().values()):
+                    if _is_symbol(sort) and len(table):
+                        table[:, i] = ranks[sort][table[:, i]]
+                h.update(relation.name().encode() + b"\0")
+                h.update(np.unique(table, axis=0).tobytes())
+            for sort in sorted(self._strings, key=lambda s: type(s).__qualname__):
+                h.update(type(sort).__qualname__.encode() + b"\0")
+                h.update("\0".join(sorted(self._strings[sort])).encode() + b"\0")
+        return h.hexdigest()
+
+    def _encode(
+        self,
+        sort: Sort,
+        values: Sequence[int] | Sequence[str] | npt.ArrayLike,
+    ) -> Column:
+        if not _is_symbol(sort):
+            return np.asarray(values, dtype=np.int64).reshape(-1)
+
+        uniques, inverse = np.unique(
+            np.asarray(values, dtype=str).reshape(-1),
+            return_inverse=True,
+        )
+        codes = self._codes.setdefault(sort, {})
+        strings = self._strings.setdefault(sort, [])
+        lookup = []
+        for s in uniques.tolist():
+            if s not in codes:
+                codes[s] = len(strings)
+                strings.append(s)
+            lookup.append(codes[s])
+        return np.array(lookup, dtype=np.int64)[inverse]
+
+    # None if some symbol was never stored
+    def _code_row(
+        self,
+        relation: Relation,
+        args: dict[str, Term],
+    ) -> Optional[tuple[int, ...]]:
+        ret = []
+        arity = relation.arity()
+        for k, term in args.items():
+            if _is_symbol(arity[k]):
+                code = self._codes.get(arity[k], {}).get(term.fact_repr())
+                if code is None:
+                    return None
+                ret.append(code)
+            else:
+                ret.append(int(term.fact_repr()))
+        return tuple(ret)
+
+    def _table(self, relation: Relation) -> Table:
+        with self._lock:
+            chunks = self._chunks.pop(relation, [])
+            if chunks:
+                if relation in self._tables:
+                    chunks.insert(0, self._tables[relation])
+                self._tables[relation] = np.unique(np.concatenate(chunks), axis=0)
+                self._row_sets.pop(relation, None)
+            return self._tables[relation]
+
+    def _atoms(self, relation: Relation, table: Table) -> list[Atom]:
+        cls = self._classes[relation]
+        columns = []
+        for i, (k, sort) in enumerate(relation.arity().items()):
+            # Each distinct value is parsed once
+            uniques, inverse = np.unique(table[:, i], return_inverse=True)
+            if _is_symbol(sort):
+                strings = self._strings[sort]
+                terms = [sort.parse(strings[code]) for code in uniques.tolist()]
+            else:
+                terms = [sort.parse(str(v)) for v in uniques.tolist()]
+            columns.append((k, [terms[j] for j in inverse.tolist()]))
+        return [cls(**{k: terms[i] for k, terms in columns}) for i in range(len(table))]
+
+
+def _raw(term: Term) -> int | str:
+    if _is_symbol(term.sort()):
+        return term.fact_repr()
+    return int(term.fact_repr())
@@ -17,16 +17,26 @@ from .util import override
 
 class Library:
     _rules: list[NamedRule]
+    _compiled: Optional[CompiledLibrary]
 
     def __init__(self) -> None:
         self._rules = []
+        self._compiled = None
 
     def register_rule(self, named_rule: NamedRule) -> None:
         self._rules.append(named_rule)
+        self._compiled = None
 
     def rules(self) -> list[NamedRule]:
         return self._rules
 
+    # Kept until the next rule is registered, so that programs over the same
+    # library share one compilation
+    def compile(self) -> CompiledLibrary:
+        if self._compiled is None:
+            self._compiled = CompiledLibrary.of(self._rules)
+        return self._compiled
+
     @staticmethod
     def merge(libraries: Iterable["Library"]) -> "Library":
         ret = Library()
@@ -35,7 +45,25 @@ class Library:
         return ret
 
 
-class Metadata(Atom):
+# Every public annotated field of a Metadata class gets a slot
+class MetadataMeta(InternedMeta):
+    def __new__(
+        mcs,
+        name: str,
+        bases: tuple[type, ...],
+        namespace: dict[str, object],
+        **kwargs: object,
+    ) -> InternedMeta:
+        annotations = namespace.get("__annotations__", {})
+        assert isinstance(annotations, dict)
+        namespace.setdefault(
+            "__slots__",
+            tuple(k for k in annotations if not k.startswith("_")),
+        )
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+
+class Metadata(Atom, metaclass=MetadataMeta):
     _relation: ClassVar[Relation]
 
     def __init_subclass__(cls, **kwargs):
@@ -68,14 +96,13 @@ class Metadata(Atom):
         return getattr(self, key)
 
     @override
-    def set_arg(self, key: str, val: Term) -> "Atom":
-        new_args = {}
-        for k in self.relation().arity():
-            if k == key:
-                new_args[k] = val
-            else:
-                new_args[k] = self.get_arg(k)
-        return type(self)(**new_args)
+    def set_args(self, args: dict[str, Term]) -> "Atom":
+        ra = self.relation().arity()
+        for k, v in args.items():
+            assert v.sort() == ra[k]
+        return self._from_fields(
+            {k: args[k] if k in args else self.get_arg(k) for k in ra}
+        )
 
     @override
     def relation(self) -> Relation:
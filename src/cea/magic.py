@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+
+from .engine import Arg, Clause, Literal, Variable
+
+# Magic-sets rewriting. Bindings are passed sideways through a body from left
+# to right, visiting EDB literals before IDB ones so that the latter see as many
+# bound arguments as possible. Infix '=' checks pass bindings along as soon as
+# one side is bound, since the rules relate their heads to their dependencies
+# only through them.
+
+
+@dataclass
+class Rewrite:
+    clauses: list[Clause]
+    queries: list[tuple[Literal, ...]]
+    # New relation name -> (relation it is derived from, positions it keeps)
+    derived: dict[str, tuple[str, tuple[int, ...]]]
+
+
+Adornment = str
+
+
+def _adorned_name(relation: str, adornment: Adornment) -> str:
+    return f"{relation}__{adornment}"
+
+
+def _magic_name(relation: str, adornment: Adornment) -> str:
+    return f"magic__{relation}__{adornment}"
+
+
+def _is_bound(arg: Arg, bound: set[str]) -> bool:
+    return not isinstance(arg, Variable) or arg.name in bound
+
+
+def _variables(lit: Literal) -> set[str]:
+    return {arg.name for arg in lit.args if isinstance(arg, Variable)}
+
+
+def _adornment(lit: Literal, bound: set[str]) -> Adornment:
+    return "".join("b" if _is_bound(arg, bound) else "f" for arg in lit.args)
+
+
+def _bound_args(args: tuple[Arg, ...], adornment: Adornment) -> tuple[Arg, ...]:
+    return tuple(arg for arg, a in zip(args, adornment) if a == "b")
+
+
+# Moves every check that is usable under the bound variables from remaining to
+# used, extending the bound variables with what the '=' checks bind
+def _close(bound: set[str], remaining: list[Literal], used: list[Literal]) -> None:
+    progress = True
+    while progress:
+        progress = False
+        for check in list(remaining):
+            lhs, rhs = check.args
+            lhs_bound = _is_bound(lhs, bound)
+            rhs_bound = _is_bound(rhs, bound)
+            if (lhs_bound and rhs_bound) or (
+                check.infix_symbol == "=" and (lhs_bound or rhs_bound)
+            ):
+                bound.update(_variables(check))
+                remaining.remove(check)
+                used.append(check)
+                progress = True
+
+
+class _Rewriter:
+    _clauses: list[Clause]
+    _idbs: set[str]
+    _out: list[Clause]
+    _derived: dict[str, tuple[str, tuple[int, ...]]]
+    _worklist: list[tuple[str, Adornment]]
+    _seen: set[tuple[str, Adornment]]
+
+    def __init__(self, clauses: list[Clause]):
+        self._clauses = clauses
+        self._idbs = {c.head.relation for c in clauses}
+        self._out = []
+        self._derived = {}
+        self._worklist = []
+        self._seen = set()
+
+    def rewrite(self, queries: list[tuple[Literal, ...]]) -> Rewrite:
+        new_queries = [self._body(body, [], set()) for body in queries]
+
+        while self._worklist:
+            relation, adornment = self._worklist.pop()
+            self._rules(relation, adornment)
+
+        return Rewrite(
+            clauses=self._out,
+            queries=new_queries,
+            derived=self._derived,
+        )
+
+    def _demand(self, relation: str, adornment: Adornment) -> None:
+        if (relation, adornment) in self._seen:
+            return
+        self._seen.add((relation, adornment))
+        self._worklist.append((relation, adornment))
+
+        positions = tuple(range(len(adornment)))
+        self._derived[_adorned_name(relation, adornment)] = (relation, positions)
+        self._derived[_magic_name(relation, adornment)] = (
+            relation,
+            tuple(i for i in positions if adornment[i] == "b"),
+        )
+
+    # Rewrites a body whose variables in bound are supplied by prefix, emitting
+    # one magic clause per IDB literal
+    def _body(
+        self,
+        body: tuple[Literal, ...],
+        prefix: list[Literal],
+        bound: set[str],
+    ) -> tuple[Literal, ...]:
+        bound = set(bound)
+        remaining = [lit for lit in body if lit.infix_symbol]
+        used: list[Literal] = []
+        new_body = list(prefix)
+
+        _close(bound, remaining, used)
+
+        relational = [lit for lit in body if not lit.infix_symbol]
+        relational.sort(key=lambda lit: lit.relation in self._idbs)
+
+        for lit in relational:
+            if lit.relation in self._idbs:
+                adornment = _adornment(lit, bound)
+                self._demand(lit.relation, adornment)
+                self._out.append(
+                    Clause(
+                        head=Literal(
+                            _magic_name(lit.relation, adornment),
+                            _bound_args(lit.args, adornment),
+                        ),
+                        body=tuple(new_body + used),
+                    )
+                )
+                new_body.append(
+                    Literal(_adorned_name(lit.relation, adornment), lit.args)
+                )
+            else:
+                new_body.append(lit)
+
+            bound.update(_variables(lit))
+            _close(bound, remaining, used)
+
+        return tuple(new_body + [lit for lit in body if lit.infix_symbol])
+
+    def _rules(self, relation: str, adornment: Adornment) -> None:
+        magic = _magic_name(relation, adornment)
+        adorned = _adorned_name(relation, adornment)
+
+        for clause in self._clauses:
+            if clause.head.relation != relation:
+                continue
+            magic_literal = Literal(magic, _bound_args(clause.head.args, adornment))
+            self._out.append(
+                Clause(
+                    head=Literal(adorned, clause.head.args),
+                    body=self._body(
+                        clause.body,
+                        prefix=[magic_literal],
+                        bound=_variables(magic_literal),
+                    ),
+                )
+            )
+
+        # Facts given directly for the relation (not derived by its rules)
+        args = tuple(Variable(f"x__{i}") for i in range(len(adornment)))
+        self._out.append(
+            Clause(
+                head=Literal(adorned, args),
+                body=(
+                    Literal(magic, _bound_args(args, adornment)),
+                    Literal(relation, args),
+                ),
+            )
+        )
+
+
+def rewrite(clauses: list[Clause], queries: list[tuple[Literal, ...]]) -> Rewrite:
+    return _Rewriter(clauses).rewrite(queries)
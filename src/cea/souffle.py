@@ -1,8 +1,18 @@
+import asyncio
 import tempfile
 import subprocess
+import concurrent.futures
+import hashlib
 import os
+import re
+import shutil
+import time
+import weakref
 
 from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from . import util
 
 
 @dataclass
@@ -23,30 +33,293 @@ class SouffleOutput:
         return "\n".join(ret)
 
 
-def run(program: str) -> SouffleOutput:
+# How many of the most recent runs the debug directory keeps
+_DEBUG_RUNS = 100
+
+
+# Raises with Souffle's error output if the run failed, after dumping the
+# program (if given) and that output for debugging
+def _check(
+    result: "subprocess.CompletedProcess[str]",
+    program: Optional[str] = None,
+    debug_dirname: Optional[str] = None,
+) -> None:
+    if program is not None:
+        _dump(program, result.stderr, debug_dirname)
+    if result.returncode != 0:
+        raise RuntimeError("Souffle failed:\n" + result.stderr)
+
+
+# Writes the program and Souffle's stderr to prog.txt and err.txt in a fresh
+# subdirectory of the given directory (or $CEA_SOUFFLE_DEBUG) if there is one,
+# so that concurrent runs never share artifacts. The subdirectory is filled
+# under a hidden name and only then renamed into place, so pruning never sees
+# a run that is still being written.
+def _dump(program: str, stderr: str, debug_dirname: Optional[str]) -> None:
+    debug_dirname = debug_dirname or os.environ.get("CEA_SOUFFLE_DEBUG")
+    if not debug_dirname:
+        return
+
+    os.makedirs(debug_dirname, exist_ok=True)
+    staging_dirname = tempfile.mkdtemp(dir=debug_dirname, prefix=".")
+    with open(staging_dirname + "/prog.txt", "w") as f:
+        f.write(program)
+    with open(staging_dirname + "/err.txt", "w") as f:
+        f.write(stderr)
+
+    # Nanoseconds, then the process and the unique staging suffix
+    run_name = "-".join(
+        [
+            f"{time.time_ns():020d}",
+            str(os.getpid()),
+            os.path.basename(staging_dirname)[1:],
+        ]
+    )
+    os.rename(staging_dirname, f"{debug_dirname}/{run_name}")
+    _prune(debug_dirname, run_name)
+
+
+# Removes all but the newest runs up to and including the given one; the
+# fixed-width prefix sorts them by age, and newer runs prune after themselves
+def _prune(debug_dirname: str, run_name: str) -> None:
+    runs = sorted(
+        name
+        for name in os.listdir(debug_dirname)
+        if re.fullmatch(r"\d{20}-\d+-\w+", name) and name <= run_name
+    )
+    for name in runs[: max(len(runs) - _DEBUG_RUNS, 0)]:
+        shutil.rmtree(f"{debug_dirname}/{name}", ignore_errors=True)
+
+
+def run(
+    program: str,
+    fact_dirname: Optional[str] = None,
+    debug_dirname: Optional[str] = None,
+) -> SouffleOutput:
     with tempfile.TemporaryDirectory() as tmp_dirname:
         program_filename = tmp_dirname + "/program.dl"
         with open(program_filename, "w") as f:
             f.write(program)
-        with open("souffle/prog.txt", "w") as prog_f:
-            prog_f.write(program)
-        with open("souffle/err.txt", "w") as err_f:
-            subprocess.run(
-                ["souffle", "-D", tmp_dirname, program_filename],
-                stdout=subprocess.DEVNULL,
-                stderr=err_f,
-            )
-        facts: dict[str, list[tuple[str, ...]]] = {}
-        for filename in os.listdir(tmp_dirname):
-            if not filename.endswith(".csv"):
-                continue
-            rel_name = filename[:-4]
-            with open(tmp_dirname + "/" + filename, "r") as f:
-                facts[rel_name] = []
-                for line in f.readlines():
-                    stripped_line = line.strip()
-                    if stripped_line == "()":
-                        facts[rel_name].append(())
-                    else:
-                        facts[rel_name].append(tuple(stripped_line.split("\t")))
-        return SouffleOutput(facts)
+        result = subprocess.run(
+            ["souffle", "-F", fact_dirname or tmp_dirname]
+            + ["-D", tmp_dirname, program_filename],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        _check(result, program, debug_dirname)
+        return _read_output(tmp_dirname)
+
+
+# Sends the program on stdin and reads the output relations from stdout, so
+# nothing but the (optional) fact directory touches the file system
+def run_piped(
+    program: str,
+    fact_dirname: Optional[str] = None,
+    debug_dirname: Optional[str] = None,
+) -> SouffleOutput:
+    args = ["souffle", "-D-"]
+    if fact_dirname:
+        args += ["-F", fact_dirname]
+    args.append("-")
+
+    result = subprocess.run(args, input=program, capture_output=True, text=True)
+    _check(result, program, debug_dirname)
+    return _parse_stdout(result.stdout.splitlines())
+
+
+# Runs independent programs in parallel; each worker thread mostly waits on its
+# own Souffle process, so the processes spread across cores
+def run_many(
+    programs: list[str],
+    fact_dirnames: Optional[list[Optional[str]]] = None,
+    max_workers: Optional[int] = None,
+    piped: bool = False,
+) -> list[SouffleOutput]:
+    if fact_dirnames is None:
+        fact_dirnames = [None] * len(programs)
+    if len(fact_dirnames) != len(programs):
+        raise ValueError("Expected one fact directory per program")
+
+    run_one = run_piped if piped else run
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or os.cpu_count()
+    ) as executor:
+        return list(executor.map(run_one, programs, fact_dirnames))
+
+
+def fingerprint(program: str) -> str:
+    return hashlib.sha256(program.encode()).hexdigest()
+
+
+def compile(program: str) -> str:
+    binary_dirname = util.cache_dir("souffle")
+    binary_filename = binary_dirname + "/" + fingerprint(program)
+    if os.path.exists(binary_filename):
+        return binary_filename
+
+    with tempfile.TemporaryDirectory() as tmp_dirname:
+        program_filename = tmp_dirname + "/program.dl"
+        with open(program_filename, "w") as f:
+            f.write(program)
+        result = subprocess.run(
+            ["souffle", "-o", tmp_dirname + "/program", program_filename],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if not os.path.exists(tmp_dirname + "/program"):
+            raise RuntimeError("Souffle compilation failed:\n" + result.stderr)
+        os.makedirs(binary_dirname, exist_ok=True)
+        os.replace(tmp_dirname + "/program", binary_filename)
+
+    return binary_filename
+
+
+def run_compiled(binary_filename: str, fact_dirname: str) -> SouffleOutput:
+    with tempfile.TemporaryDirectory() as tmp_dirname:
+        result = subprocess.run(
+            [binary_filename, "-F", fact_dirname, "-D", tmp_dirname],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        _check(result)
+        return _read_output(tmp_dirname)
+
+
+###############################################################################
+# Asynchronous runs
+
+_concurrency_limit: int = os.cpu_count() or 1
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+_semaphores = weakref.WeakKeyDictionary()
+
+
+# Bounds the number of Souffle processes in flight per event loop
+def set_concurrency_limit(limit: int) -> None:
+    global _concurrency_limit
+    if limit < 1:
+        raise ValueError("Concurrency limit must be positive")
+    _concurrency_limit = limit
+    _semaphores.clear()
+
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(_concurrency_limit)
+    return _semaphores[loop]
+
+
+async def _exec(
+    args: list[str],
+    stdin: Optional[str],
+) -> "subprocess.CompletedProcess[str]":
+    async with _semaphore():
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate(
+            stdin.encode() if stdin is not None else None
+        )
+        assert proc.returncode is not None
+        return subprocess.CompletedProcess(
+            args, proc.returncode, stdout.decode(), stderr.decode()
+        )
+
+
+async def run_async(
+    program: str,
+    fact_dirname: Optional[str] = None,
+    debug_dirname: Optional[str] = None,
+    piped: bool = False,
+) -> SouffleOutput:
+    if piped:
+        args = ["souffle", "-D-"]
+        if fact_dirname:
+            args += ["-F", fact_dirname]
+        args.append("-")
+        result = await _exec(args, stdin=program)
+        _check(result, program, debug_dirname)
+        return _parse_stdout(result.stdout.splitlines())
+
+    with tempfile.TemporaryDirectory() as tmp_dirname:
+        program_filename = tmp_dirname + "/program.dl"
+        with open(program_filename, "w") as f:
+            f.write(program)
+        result = await _exec(
+            ["souffle", "-F", fact_dirname or tmp_dirname]
+            + ["-D", tmp_dirname, program_filename],
+            stdin=None,
+        )
+        _check(result, program, debug_dirname)
+        return _read_output(tmp_dirname)
+
+
+async def run_compiled_async(
+    binary_filename: str,
+    fact_dirname: str,
+) -> SouffleOutput:
+    with tempfile.TemporaryDirectory() as tmp_dirname:
+        result = await _exec(
+            [binary_filename, "-F", fact_dirname, "-D", tmp_dirname],
+            stdin=None,
+        )
+        _check(result)
+        return _read_output(tmp_dirname)
+
+
+###############################################################################
+# Output parsing
+
+
+def _parse_row(line: str) -> tuple[str, ...]:
+    stripped_line = line.strip()
+    if stripped_line == "()":
+        return ()
+    return tuple(stripped_line.split("\t"))
+
+
+# Each relation is printed as
+#   ---------------
+#   <name>
+#   <attribute names>
+#   ===============
+#   <rows>
+#   ===============
+def _parse_stdout(lines: Iterable[str]) -> SouffleOutput:
+    facts: dict[str, list[tuple[str, ...]]] = {}
+    rel_name: Optional[str] = None
+    in_rows = False
+    expect_name = False
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("---------------"):
+            expect_name = True
+            in_rows = False
+        elif expect_name:
+            rel_name = line.strip()
+            facts[rel_name] = []
+            expect_name = False
+        elif line.startswith("==============="):
+            in_rows = not in_rows
+        elif in_rows and rel_name is not None:
+            facts[rel_name].append(_parse_row(line))
+    return SouffleOutput(facts)
+
+
+def _read_output(dirname: str) -> SouffleOutput:
+    facts: dict[str, list[tuple[str, ...]]] = {}
+    for filename in os.listdir(dirname):
+        if not filename.endswith(".csv"):
+            continue
+        rel_name = filename[:-4]
+        with open(dirname + "/" + filename, "r") as f:
+            facts[rel_name] = []
+            for line in f:
+                facts[rel_name].append(_parse_row(line))
+    return SouffleOutput(facts)
@@ -29,13 +29,12 @@ class TimeSort(Sort):
 
     @override
     def var(self, s: str) -> Var:
-        class V(Var, Time):
-            pass
-
-        return V(s)
+        return TimeVar(s)
 
 
 class Time(Term):
+    __slots__ = ()
+
     _sort: ClassVar[Sort] = TimeSort()
 
     @override
@@ -53,7 +52,13 @@ class Time(Term):
         return TimeLt(lhs=self, rhs=other)
 
 
+class TimeVar(Var, Time):
+    __slots__ = ()
+
+
 class Day(Time):
+    __slots__ = ("_day",)
+
     _day: int
 
     def __init__(self, day: int):
@@ -108,13 +113,12 @@ class PopulationSort(Sort):
 
     @override
     def var(cls, name: str) -> Var:
-        class V(Var, Population):
-            pass
-
-        return V(name)
+        return PopulationVar(name)
 
 
 class Population(Term):
+    __slots__ = ()
+
     _sort: ClassVar[Sort] = PopulationSort()
 
     @override
@@ -129,7 +133,13 @@ class Population(Term):
         raise ValueError("Cannot compute name")
 
 
+class PopulationVar(Var, Population):
+    __slots__ = ()
+
+
 class Pop(Population):
+    __slots__ = ("symbol",)
+
     _counter: ClassVar[int] = 0
 
     symbol: str
@@ -179,13 +189,12 @@ class InfectionSort(Sort):
 
     @override
     def var(cls, name: str) -> Var:
-        class V(Var, Infection):
-            pass
-
-        return V(name)
+        return InfectionVar(name)
 
 
 class Infection(Term):
+    __slots__ = ()
+
     _sort: ClassVar[Sort] = InfectionSort()
 
     @override
@@ -203,7 +212,13 @@ class Infection(Term):
         raise ValueError("Cannot compute negative controls")
 
 
+class InfectionVar(Var, Infection):
+    __slots__ = ()
+
+
 class Inf(Infection):
+    __slots__ = ("_library", "_negative_controls")
+
     _library: str
     _negative_controls: str
 
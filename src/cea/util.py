@@ -1,5 +1,7 @@
 from typing import ParamSpec, TypeVar, Callable
 
+import os
+
 P = ParamSpec("P")
 T = TypeVar("T")
 
@@ -20,3 +22,11 @@ def string_width(s: str) -> int:
         return 0
 
     return max(len(line) for line in s.splitlines())
+
+
+def cache_dir(name: str) -> str:
+    root = os.environ.get(
+        "CEA_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "cea"),
+    )
+    return os.path.join(root, name)
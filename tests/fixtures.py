@@ -0,0 +1,55 @@
+import shutil
+
+from cea.core import *
+from cea.stdbiolib import *
+
+unsorted = Pop("unsorted")
+off = Pop("off")
+on = Pop("on")
+inf = Inf(library="library.csv", negative_controls="negative_controls.csv")
+
+trace: list[Atom] = [
+    Infect.M(t=Day(1), pop=unsorted, inf=inf),
+    CellSort.M(t=Day(2), pop_in=unsorted, pop_no=off, pop_yes=on),
+    Seq.M(t=Day(3), pop=off),
+    Seq.M(t=Day(3), pop=on),
+    Seq.M(t=Day(4), pop=on),
+]
+
+queries: list[Query] = [
+    Query([VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=off, pop2=on)]),
+    Query([VolcanoPlot.M(t1=Day(3), t2=Day(4), pop1=off, pop2=on)]),
+    Query([Infected.M(t=Day(1), pop=Population.sort().var("p"), inf=inf)]),
+    Query(
+        [
+            ReadCountMatrix.M(
+                t1=Time.sort().var("t1"),
+                t2=Time.sort().var("t2"),
+                pop1=on,
+                pop2=on,
+            ),
+            TimeLt(lhs=Time.sort().var("t1"), rhs=Time.sort().var("t2")),
+        ]
+    ),
+]
+
+
+def program(
+    edbs: list[Atom] = trace, backend_name: str = "in-process"
+) -> DatalogProgram:
+    return DatalogProgram(edbs, lib.rules(), backend=get_backend(backend_name))
+
+
+def available_backends() -> list[str]:
+    if shutil.which("souffle"):
+        return list(BACKENDS)
+    return [name for name in BACKENDS if not name.startswith("souffle")]
+
+
+def show(assignments: list[Assignment]) -> list[str]:
+    return sorted(
+        "{"
+        + ", ".join(f"{k}: {v.dl_repr()}" for k, v in sorted(assignment.items()))
+        + "}"
+        for assignment in assignments
+    )
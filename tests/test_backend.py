@@ -0,0 +1,231 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import expecttest
+
+from cea.core import *
+from cea.stdbiolib import *
+
+from tests.fixtures import available_backends, on, queries, show, trace
+
+
+class Test(expecttest.TestCase):
+    def results(self, backend_name: str, magic_sets: bool = False) -> list[list[str]]:
+        program = DatalogProgram(
+            edbs=trace,
+            idbs=lib.rules(),
+            backend=get_backend(backend_name),
+            magic_sets=magic_sets,
+        )
+        return [
+            show(assignments)
+            for assignments in program.run_queries(
+                [Query(q.atoms(), name=f"Goal{i}") for i, q in enumerate(queries)]
+            )
+        ]
+
+    def test_backends_agree(self) -> None:
+        backends = available_backends()
+        expected = self.results(backends[0])
+        for name in backends[1:]:
+            with self.subTest(backend=name):
+                self.assertEqual(self.results(name), expected)
+
+    def test_single_queries_agree_with_batch(self) -> None:
+        for name in available_backends():
+            program = DatalogProgram(trace, lib.rules(), backend=get_backend(name))
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    [show(program.run_query(q)) for q in queries],
+                    self.results(name),
+                )
+
+    def test_results(self) -> None:
+        self.assertExpectedInline(
+            "\n".join(str(r) for r in self.results("in-process")),
+            """\
+['{}']
+[]
+['{p: "off"}', '{p: "on"}', '{p: "unsorted"}']
+['{t1: 3, t2: 4}']""",
+        )
+
+    def test_run_queries_async(self) -> None:
+        async def run_all(program: DatalogProgram) -> list[list[Assignment]]:
+            return list(
+                await asyncio.gather(*[program.run_query_async(q) for q in queries])
+            )
+
+        for name in available_backends():
+            program = DatalogProgram(trace, lib.rules(), backend=get_backend(name))
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    [show(a) for a in asyncio.run(run_all(program))],
+                    self.results(name),
+                )
+
+    def test_run_many(self) -> None:
+        for name in available_backends():
+            programs = [
+                DatalogProgram(trace[:i], lib.rules(), backend=get_backend(name))
+                for i in range(len(trace) + 1)
+            ]
+            jobs = [(p, q) for p in programs for q in queries]
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    [show(a) for a in run_many(jobs, max_workers=4)],
+                    [show(p.run_query(q)) for p, q in jobs],
+                )
+
+    def test_magic_sets_agree(self) -> None:
+        for name in available_backends():
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    self.results(name, magic_sets=True),
+                    self.results(name),
+                )
+
+    def test_limit(self) -> None:
+        for name in available_backends():
+            program = DatalogProgram(trace, lib.rules(), backend=get_backend(name))
+            with self.subTest(backend=name):
+                limited = show(program.run_query(queries[2], limit=2))
+                self.assertEqual(len(limited), 2)
+                self.assertLess(set(limited), set(show(program.run_query(queries[2]))))
+                self.assertTrue(program.exists(queries[0]))
+                self.assertFalse(program.exists(queries[1]))
+                with self.assertRaises(ValueError):
+                    program.run_query(queries[2], limit=0)
+
+    def test_projection(self) -> None:
+        t1, t2 = Time.sort().var("t1"), Time.sort().var("t2")
+        query = Query(
+            [
+                ReadCountMatrix.M(t1=t1, t2=t2, pop1=on, pop2=on),
+                TimeLt(lhs=Time.sort().var("t0"), rhs=t2),
+                Seq.M(t=Time.sort().var("t0"), pop=on),
+            ],
+            variables=["t1"],
+        )
+        self.assertEqual(list(query.relation().arity()), ["t1"])
+        for name in available_backends():
+            program = DatalogProgram(trace, lib.rules(), backend=get_backend(name))
+            with self.subTest(backend=name):
+                self.assertEqual(show(program.run_query(query)), ["{t1: 3}", "{t1: 4}"])
+        with self.assertRaises(ValueError):
+            Query([Seq.M(t=t1, pop=on)], variables=["t2"])
+
+    def test_add_edbs(self) -> None:
+        named = [Query(q.atoms(), name=f"Goal{i}") for i, q in enumerate(queries)]
+        for name in available_backends():
+            program = DatalogProgram(trace[:3], lib.rules(), backend=get_backend(name))
+            with self.subTest(backend=name):
+                self.assertFalse(program.exists(queries[0]))
+                program.add_edbs(trace[3:] + trace[:1])
+                self.assertEqual(len(program.edbs()), len(trace))
+                self.assertEqual(
+                    [show(a) for a in program.run_queries(named)],
+                    self.results(name),
+                )
+                self.assertIsNotNone(
+                    program.provenance(
+                        VolcanoPlot.M(t1=Day(3), t2=Day(4), pop1=on, pop2=on)
+                    )
+                )
+
+    def test_cache_across_programs(self) -> None:
+        p = Population.sort().var("p")
+        query = Query([PopulationEq(lhs=p, rhs=Pop("new"))])
+        with tempfile.TemporaryDirectory() as dirname:
+            cache = ResultCache(dirname=dirname)
+            first = DatalogProgram(
+                trace, lib.rules(), backend=get_backend("in-process"), cache=cache
+            )
+            self.assertEqual(show(first.run_query(query)), ['{p: "new"}'])
+
+            # Gives Pop("x") the id Pop("new") has in the first program
+            second = DatalogProgram(
+                trace, lib.rules(), backend=get_backend("in-process"), cache=cache
+            )
+            second.run_query(Query([PopulationEq(lhs=p, rhs=Pop("x"))]))
+            self.assertEqual(show(second.run_query(query)), ['{p: "new"}'])
+            self.assertEqual(cache.hits(), 1)
+
+    def test_fact_files(self) -> None:
+        program = DatalogProgram(
+            trace[:3], lib.rules(), backend=get_backend("in-process")
+        )
+
+        def contents() -> dict[str, list[str]]:
+            dirname = program._fact_dirname()
+            ret = {}
+            for filename in sorted(os.listdir(dirname)):
+                with open(f"{dirname}/{filename}") as f:
+                    ret[filename] = f.read().splitlines()
+            return ret
+
+        def lines(atoms: list[Atom]) -> list[str]:
+            return ["\t".join(str(v) for v in program._engine_row(a)) for a in atoms]
+
+        files = contents()
+        self.assertEqual(
+            sorted(files), sorted(f"{r.name()}.facts" for r in program._relations)
+        )
+        self.assertEqual(files["Seq_M.facts"], lines(trace[2:3]))
+        self.assertEqual(files["Infected_M.facts"], [])
+
+        # Appended to the files already written
+        program.add_edbs(trace[3:])
+        self.assertEqual(contents()["Seq_M.facts"], lines(trace[2:]))
+        self.assertEqual(contents()["Infect_M.facts"], lines(trace[:1]))
+
+    def test_parameterized(self) -> None:
+        t1, p = Time.sort().var("t1"), Population.sort().var("p")
+        query = Query(
+            [ReadCountMatrix.M(t1=t1, t2=Day(4), pop1=on, pop2=p)], name="Goal0"
+        )
+        template, param = query.parameterized()
+        assert param is not None
+        self.assertExpectedInline(
+            " ".join(a.dl_repr() for a in template.atoms()),
+            """Goal0_Param(param__0, param__1) ReadCountMatrix_M(t1, param__0, param__1, p)""",
+        )
+        self.assertExpectedInline(param.dl_repr(), """Goal0_Param(4, "on")""")
+        self.assertEqual(template.relation(), query.relation())
+        self.assertEqual(Query([Seq.M(t=t1, pop=p)]).parameterized()[1], None)
+
+    def test_compiled_inputs(self) -> None:
+        program = DatalogProgram(trace, lib.rules(), backend=get_backend("in-process"))
+        query = Query(queries[3].atoms(), name="Goal0")
+        template, param = query.parameterized()
+        assert param is not None
+        _, idbs = program.slice([query])
+        relations = SouffleCompiledBackend._input_relations(idbs, [template])
+        self.assertExpectedInline(
+            " ".join(r.name() for r in relations),
+            """Infected_M Infect_M CellSort_M ReadCountMatrix_M Seq_M Goal0_Param""",
+        )
+
+        with SouffleCompiledBackend._fact_dirname(
+            program, relations, [param]
+        ) as dirname:
+            self.assertEqual(
+                sorted(os.listdir(dirname)),
+                sorted(f"{r.name()}.facts" for r in relations),
+            )
+            self.assertFalse(os.path.islink(f"{dirname}/Goal0_Param.facts"))
+            self.assertTrue(os.path.islink(f"{dirname}/Seq_M.facts"))
+            with open(f"{dirname}/Goal0_Param.facts") as f:
+                self.assertEqual(
+                    f.read(),
+                    "\t".join(str(v) for v in program._engine_row(param)) + "\n",
+                )
+
+    def test_unknown_backend(self) -> None:
+        with self.assertRaises(ValueError):
+            get_backend("prolog")
+
+
+if __name__ == "__main__":
+    unittest.main()
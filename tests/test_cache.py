@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+import unittest
+import expecttest
+
+from cea.cache import ResultCache
+
+
+class Test(expecttest.TestCase):
+    def test_hit_miss(self) -> None:
+        with tempfile.TemporaryDirectory() as dirname:
+            cache = ResultCache(dirname=dirname)
+            key = ResultCache.key("program", "query")
+
+            self.assertIsNone(cache.get(key))
+            cache.put(key, [("1", "p0"), ()])
+            self.assertEqual(cache.get(key), [("1", "p0"), ()])
+
+            self.assertEqual((cache.hits(), cache.misses()), (1, 1))
+
+    def test_key_separates_parts(self) -> None:
+        self.assertNotEqual(ResultCache.key("ab", "c"), ResultCache.key("a", "bc"))
+
+    def test_evicts_least_recently_used(self) -> None:
+        with tempfile.TemporaryDirectory() as dirname:
+            cache = ResultCache(dirname=dirname, max_entries=2)
+
+            cache.put("a", [])
+            cache.put("b", [])
+            past = time.time() - 60
+            os.utime(os.path.join(dirname, "a.json"), (past, past))
+            os.utime(os.path.join(dirname, "b.json"), (past - 60, past - 60))
+            cache.get("b")
+            cache.put("c", [])
+
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), [])
+            self.assertEqual(cache.get("c"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import pickle
+import tempfile
+from collections import OrderedDict
+import unittest
+import expecttest
+
+from cea.core import *
+from cea.stdbiolib import *
+
+from tests.fixtures import inf, off, on, program
+
+trace: list[Atom] = [
+    Infect.M(t=Day(1), pop=off, inf=inf),
+    Seq.M(t=Day(3), pop=off),
+]
+
+
+class Test(expecttest.TestCase):
+    def test_slice(self) -> None:
+        relations, idbs = program(trace).slice(
+            [Query([PhenotypeScore.M(t1=Day(3), t2=Day(3), pop1=off, pop2=on)])]
+        )
+        self.assertExpectedInline(
+            " ".join(r.name() for r in relations),
+            """Infect_M Seq_M Infected_M CellSort_M ReadCountMatrix_M PhenotypeScore_M""",
+        )
+        self.assertExpectedInline(
+            " ".join(idb.name() for idb in idbs),
+            """infect_infected commute_infected_sort_yes commute_infected_sort_no quantify mageck_sequential mageck_parallel""",
+        )
+
+    def test_slice_edb(self) -> None:
+        relations, idbs = program(trace).slice([Query([Seq.M(t=Day(3), pop=off)])])
+        self.assertEqual([r.name() for r in relations], ["Seq_M"])
+        self.assertEqual(idbs, [])
+
+    def test_sliced_dl_repr(self) -> None:
+        dl = program(trace).dl_repr(
+            queries=[Query([Infected.M.free("inf__")])],
+        )
+        self.assertNotIn("Seq_M", dl)
+        self.assertNotIn("// quantify", dl)
+        self.assertIn("// infect_infected", dl)
+
+    def test_symbols(self) -> None:
+        symbols = SymbolTable()
+        self.assertEqual(symbols.encode(on), 0)
+        self.assertEqual(symbols.encode(off), 1)
+        self.assertEqual(symbols.encode(Pop("on")), 0)
+        self.assertEqual(symbols.decode(1).dl_repr(), off.dl_repr())
+
+    def test_symbol_ids_ignore_edb_order(self) -> None:
+        reversed_program = DatalogProgram(
+            list(reversed(trace)), lib.rules(), backend=get_backend("in-process")
+        )
+        for atom in trace:
+            self.assertEqual(
+                program(trace)._engine_row(atom),
+                reversed_program._engine_row(atom),
+            )
+
+    def test_interned_declaration(self) -> None:
+        self.assertExpectedInline(
+            Seq.M.class_relation().dl_repr(interned=True),
+            """.decl Seq_M(t: number, pop: number)""",
+        )
+
+    def test_interning(self) -> None:
+        self.assertIs(Day(3), Day(3))
+        self.assertIs(Seq.M(t=Day(3), pop=Pop("off")), trace[1])
+        self.assertIs(Time.sort().var("t"), Time.sort().var("t"))
+        self.assertNotEqual(Seq.M(t=Day(4), pop=off), trace[1])
+        self.assertNotIn(Seq.M(t=Day(4), pop=off), trace)
+
+    def test_relation_interning(self) -> None:
+        r = Relation("R", OrderedDict(t=Time.sort(), pop=Population.sort()))
+        self.assertIs(
+            Relation("R", OrderedDict(t=Time.sort(), pop=Population.sort())), r
+        )
+        self.assertIsNot(Relation("R", OrderedDict(t=Time.sort())), r)
+        self.assertIs(Seq.M.class_relation(), trace[1].relation())
+        self.assertEqual(len({r, Seq.M.class_relation(), r}), 2)
+
+    def test_rule_index(self) -> None:
+        relation = PhenotypeScore.M.class_relation()
+        self.assertEqual(
+            [idb.name() for idb in program(trace).idbs_for(relation)],
+            ["mageck_sequential", "mageck_parallel"],
+        )
+        self.assertEqual(program(trace).idbs_for(Seq.M.class_relation()), [])
+
+    def test_compiled_library(self) -> None:
+        compiled = lib.compile()
+        self.assertEqual(compiled.fingerprint, lib.compile().fingerprint)
+        with tempfile.TemporaryDirectory() as dirname:
+            compiled.save(dirname + "/lib.pickle")
+            loaded = CompiledLibrary.load(dirname + "/lib.pickle")
+        self.assertEqual(loaded.fingerprint, compiled.fingerprint)
+        self.assertEqual(loaded.clause_texts, compiled.clause_texts)
+
+        query = Query([Infected.M.free("inf__")])
+        from_rules = program(trace)
+        from_loaded = DatalogProgram(trace, loaded, backend=get_backend("in-process"))
+        self.assertEqual(
+            from_loaded._souffle_dl_repr([query], from_rules._relations),
+            from_rules._souffle_dl_repr([query], from_rules._relations),
+        )
+        self.assertEqual(from_loaded.run_query(query), from_rules.run_query(query))
+        self.assertEqual(from_loaded._normalized_repr(), from_rules._normalized_repr())
+
+    def test_compile_cached(self) -> None:
+        library = Library()
+        library.register_rule(lib.rules()[0])
+        compiled = library.compile()
+        self.assertIs(library.compile(), compiled)
+        library.register_rule(lib.rules()[1])
+        self.assertEqual(list(library.compile().rules), lib.rules()[:2])
+
+    def test_fingerprint_constants(self) -> None:
+        def rules(pop: Pop) -> list[NamedRule]:
+            seq = Seq.M.free("seq__")
+            return [
+                NamedRule(
+                    label=program,
+                    rule=Rule(
+                        head=Seq.M.free("ret__"),
+                        dependencies=OrderedDict(seq=seq),
+                        checks=(PopulationEq(lhs=seq.pop, rhs=pop),),
+                    ),
+                )
+            ]
+
+        self.assertNotEqual(
+            CompiledLibrary.of(rules(on)).fingerprint,
+            CompiledLibrary.of(rules(off)).fingerprint,
+        )
+
+    def test_provenance_on_demand(self) -> None:
+        p = program(trace)
+        infected = Infected.M(t=Day(1), pop=off, inf=inf)
+        self.assertTrue(p.exists(Query([infected])))
+        self.assertIsNone(p._provenance_engine)
+        explained = p.provenance(infected)
+        assert explained is not None
+        self.assertEqual(explained[0].name(), "infect_infected")
+        self.assertIsNotNone(p._provenance_engine)
+
+    def test_edb_index(self) -> None:
+        p = program(trace)
+        self.assertTrue(p.is_edb(Seq.M(t=Day(3), pop=off)))
+        self.assertFalse(p.is_edb(Seq.M(t=Day(4), pop=off)))
+        self.assertEqual(p.edbs_of(Seq.M.class_relation()), [trace[1]])
+        self.assertEqual(p.edbs_of(Seq.M.class_relation(), pop=off), [trace[1]])
+        self.assertEqual(p.edbs_of(Seq.M.class_relation(), pop=on), [])
+        self.assertEqual(p.edbs_of(Infected.M.class_relation(), t=Day(1)), [])
+        with self.assertRaises(ValueError):
+            p.edbs_of(Seq.M.class_relation(), inf=on)
+
+    def test_substitute_all(self) -> None:
+        t, p = Time.sort().var("t"), Population.sort().var("p")
+        atom = Seq.M(t=t, pop=p)
+        self.assertIs(atom.substitute_all({"t": Day(3), "p": off}), trace[1])
+        # Simultaneous, not sequential
+        self.assertIs(
+            atom.substitute_all({"t": Time.sort().var("p"), "p": off}),
+            Seq.M(t=Time.sort().var("p"), pop=off),
+        )
+        self.assertIs(atom.substitute_all({}), atom)
+
+        rule = lib.rules()[0].rule()
+        assignment = {
+            name: Day(1) if name.endswith("__t") else off
+            for name in ["inf__t", "inf__pop", "ret__t"]
+        }
+        self.assertEqual(
+            rule.substitute_body(assignment),
+            [a.substitute_all(assignment) for a in rule.body()],
+        )
+
+    def test_immutable(self) -> None:
+        with self.assertRaises(AttributeError):
+            trace[1].t = Day(4)  # type: ignore[misc]
+
+    def test_pickle(self) -> None:
+        for atom in trace:
+            self.assertIs(pickle.loads(pickle.dumps(atom)), atom)
+        self.assertIs(
+            pickle.loads(pickle.dumps(Time.sort().var("t"))),
+            Time.sort().var("t"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+import expecttest
+
+from cea.core import *
+from cea.derivation import *
+from cea.stdbiolib import *
+
+from tests.fixtures import off, on, program, trace
+
+edbs = trace[:4]
+
+goal = VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=off, pop2=on)
+
+
+class FirstInteractor(Interactor):
+    def display_tree(self, derivation_tree: Tree) -> None:
+        pass
+
+    def select_goal(self, goals: list[PathedAtom]) -> PathedAtom:
+        return goals[0]
+
+    def select_rule(
+        self, rules: list[tuple[NamedRule, list[Assignment]]]
+    ) -> tuple[NamedRule, list[Assignment]]:
+        return [(r, aa) for r, aa in rules if aa][0]
+
+    def select_assignment(self, assignments: list[Assignment]) -> Assignment:
+        return assignments[0]
+
+
+class AsyncFirstInteractor(AsyncInteractor):
+    _interactor = FirstInteractor()
+
+    async def display_tree(self, derivation_tree: Tree) -> None:
+        pass
+
+    async def select_goal(self, goals: list[PathedAtom]) -> PathedAtom:
+        return self._interactor.select_goal(goals)
+
+    async def select_rule(
+        self, rules: list[tuple[NamedRule, list[Assignment]]]
+    ) -> tuple[NamedRule, list[Assignment]]:
+        return self._interactor.select_rule(rules)
+
+    async def select_assignment(self, assignments: list[Assignment]) -> Assignment:
+        return self._interactor.select_assignment(assignments)
+
+
+class Test(expecttest.TestCase):
+    def test_construct(self) -> None:
+        dt = Constructor(program(edbs), FirstInteractor()).construct(goal)
+        self.assertExpectedInline(
+            dt.tree_string(),
+            """\
+-- VolcanoPlot_M(3, 3, "off", "on") [volcano_plot]
+---- <ps>: PhenotypeScore_M(3, 3, "off", "on") [mageck_parallel]
+------ <rcm>: ReadCountMatrix_M(3, 3, "off", "on") [quantify]
+-------- <inf1>: Infected_M(1, "off", "library.csv;negative_controls.csv") [commute_infected_sort_no]
+---------- <inf>: Infected_M(1, "unsorted", "library.csv;negative_controls.csv") [infect_infected]
+------------ <inf>: Infect_M(1, "unsorted", "library.csv;negative_controls.csv") [leaf]
+---------- <cs>: CellSort_M(2, "unsorted", "off", "on") [leaf]
+-------- <inf2>: Infected_M(1, "on", "library.csv;negative_controls.csv") [commute_infected_sort_yes]
+---------- <inf>: Infected_M(1, "unsorted", "library.csv;negative_controls.csv") [infect_infected]
+------------ <inf>: Infect_M(1, "unsorted", "library.csv;negative_controls.csv") [leaf]
+---------- <cs>: CellSort_M(2, "unsorted", "off", "on") [leaf]
+-------- <seq1>: Seq_M(3, "off") [leaf]
+-------- <seq2>: Seq_M(3, "on") [leaf]""",
+        )
+
+    def test_construct_async(self) -> None:
+        dt = asyncio.run(
+            Constructor(program(edbs), AsyncFirstInteractor()).construct_async(goal)
+        )
+        self.assertEqual(
+            dt.tree_string(),
+            Constructor(program(edbs), FirstInteractor()).construct(goal).tree_string(),
+        )
+
+    def test_explain(self) -> None:
+        dt = explain(program(edbs), goal)
+        assert dt is not None
+        self.assertEqual(
+            dt.tree_string(),
+            Constructor(program(edbs), FirstInteractor()).construct(goal).tree_string(),
+        )
+        self.assertIsNone(
+            explain(
+                program(edbs), VolcanoPlot.M(t1=Day(3), t2=Day(4), pop1=off, pop2=on)
+            )
+        )
+
+    def test_static_pruning(self) -> None:
+        rules = {r.name(): r for r in lib.rules()}
+        constructor = Constructor(program(edbs), FirstInteractor())
+        same_day = PhenotypeScore.M(t1=Day(3), t2=Day(3), pop1=off, pop2=on)
+        next_day = PhenotypeScore.M(t1=Day(3), t2=Day(4), pop1=on, pop2=on)
+        self.assertIsNone(constructor._rule_query(same_day, rules["mageck_sequential"]))
+        self.assertIsNotNone(
+            constructor._rule_query(same_day, rules["mageck_parallel"])
+        )
+        self.assertIsNotNone(
+            constructor._rule_query(next_day, rules["mageck_sequential"])
+        )
+        self.assertIsNone(constructor._rule_query(next_day, rules["mageck_parallel"]))
+
+    def test_interactor_kind(self) -> None:
+        with self.assertRaises(ValueError):
+            Constructor(program(edbs), AsyncFirstInteractor()).construct(goal)
+
+
+if __name__ == "__main__":
+    unittest.main()
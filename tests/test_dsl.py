@@ -0,0 +1,44 @@
+import unittest
+import expecttest
+
+from cea.dsl import Program
+from cea.stdbiolib import *
+
+from tests.fixtures import off, trace
+
+
+def program() -> Program:
+    p = Program(backend="in-process")
+    for m, d in zip(trace, [Infect.D(), CellSort.D(), Seq.D(path="off.fastq")]):
+        p.do(m, d)
+    return p
+
+
+class Test(expecttest.TestCase):
+    def test_derivable(self) -> None:
+        p = program()
+        self.assertEqual(
+            p.derivable(VolcanoPlot.M),
+            {VolcanoPlot.M: [VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=off, pop2=off)]},
+        )
+
+        # Propagated into the existing materialization
+        p.do(trace[3], Seq.D(path="on.fastq"))
+        derivable = p.derivable(VolcanoPlot.M, ReadCountMatrix.M)
+        self.assertExpectedInline(
+            "\n".join(m.unparse() for m in derivable[VolcanoPlot.M]),
+            """\
+VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=Pop("off"), pop2=Pop("off"))
+VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=Pop("off"), pop2=Pop("on"))
+VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=Pop("on"), pop2=Pop("off"))
+VolcanoPlot.M(t1=Day(3), t2=Day(3), pop1=Pop("on"), pop2=Pop("on"))""",
+        )
+        self.assertEqual(len(derivable[ReadCountMatrix.M]), 4)
+
+    def test_shared_compilation(self) -> None:
+        self.assertIs(Program()._library, Program(lib)._library)
+        self.assertIs(Program()._library, lib.compile())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import expecttest
+
+from cea.engine import *
+
+
+def lit(relation: str, *args: Arg, infix_symbol: Optional[str] = None) -> Literal:
+    return Literal(relation, args, infix_symbol)
+
+
+X, Y, Z = Variable("x"), Variable("y"), Variable("z")
+
+path_clauses = [
+    Clause(head=lit("path", X, Y), body=(lit("edge", X, Y),)),
+    Clause(head=lit("path", X, Z), body=(lit("path", X, Y), lit("edge", Y, Z))),
+]
+
+
+class Test(expecttest.TestCase):
+    def test_transitive_closure(self) -> None:
+        e = Engine(path_clauses)
+        e.add("edge", [(1, 2), (2, 3), (3, 4)])
+        self.assertEqual(
+            sorted(e.query([lit("path", 1, X)], head=["x"])),
+            [(2,), (3,), (4,)],
+        )
+
+    def test_incremental(self) -> None:
+        e = Engine(path_clauses)
+        e.add("edge", [(1, 2), (3, 4)])
+        e.run()
+        self.assertEqual(len(e.table("path")), 2)
+        e.add("edge", [(2, 3)])
+        self.assertEqual(
+            sorted(e.query([lit("path", X, 4)], head=["x"])),
+            [(1,), (2,), (3,)],
+        )
+
+    def test_provenance(self) -> None:
+        e = Engine(path_clauses, provenance=True)
+        e.add("edge", [(1, 2), (2, 3)])
+        self.assertEqual(e.provenance("path", (1, 2)), (0, {"x": 1, "y": 2}))
+        self.assertEqual(e.provenance("path", (1, 3)), (1, {"x": 1, "y": 2, "z": 3}))
+        self.assertIsNone(e.provenance("edge", (1, 2)))
+        self.assertIsNone(e.provenance("path", (3, 1)))
+
+    def test_infix_checks(self) -> None:
+        e = Engine(
+            [
+                Clause(
+                    head=lit("later", X, Z),
+                    body=(
+                        lit("event", X, Y),
+                        lit("event", Z, Y),
+                        lit("<", X, Z, infix_symbol="<"),
+                    ),
+                ),
+                Clause(
+                    head=lit("copy", Z, Y),
+                    body=(lit("event", X, Y), lit("=", Z, X, infix_symbol="=")),
+                ),
+            ]
+        )
+        e.add("event", [(1, "a"), (3, "a"), (2, "b")])
+        self.assertEqual(e.query([lit("later", X, Y)], head=["x", "y"]), [(1, 3)])
+        self.assertEqual(len(e.table("copy")), 3)
+
+    def test_repeated_variable(self) -> None:
+        e = Engine([])
+        e.add("edge", [(1, 1), (1, 2)])
+        self.assertEqual(e.query([lit("edge", X, X)], head=["x"]), [(1,)])
+
+    def test_limit(self) -> None:
+        e = Engine(path_clauses)
+        e.add("edge", [(i, i + 1) for i in range(10)])
+        self.assertEqual(len(e.query([lit("path", X, Y)], head=["x"], limit=3)), 3)
+
+    def test_unbound_head(self) -> None:
+        with self.assertRaises(ValueError):
+            Engine([Clause(head=lit("bad", X, Y), body=(lit("edge", X, X),))])
+
+
+if __name__ == "__main__":
+    unittest.main()
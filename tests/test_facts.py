@@ -0,0 +1,87 @@
+import io
+import unittest
+import expecttest
+
+from cea.core import *
+from cea.facts import FactStore
+from cea.stdbiolib import *
+
+from tests.fixtures import available_backends, off, on, queries, trace
+
+query = queries[3]
+
+
+def store() -> FactStore:
+    facts = FactStore()
+    facts.extend(trace[:2])
+    facts.append(Seq.M, t=[4, 3, 3, 4], pop=["on", "off", "on", "on"])
+    return facts
+
+
+class Test(expecttest.TestCase):
+    def test_dedup(self) -> None:
+        facts = store()
+        self.assertEqual(len(facts), 5)
+        self.assertEqual(set(facts.atoms()), set(trace))
+
+    def test_lookup(self) -> None:
+        facts = store()
+        self.assertTrue(facts.contains(Seq.M(t=Day(4), pop=on)))
+        self.assertFalse(facts.contains(Seq.M(t=Day(4), pop=off)))
+        self.assertFalse(facts.contains(Seq.M(t=Day(4), pop=Pop("other"))))
+        self.assertEqual(
+            facts.matching(Seq.M.class_relation(), t=Day(3)),
+            [Seq.M(t=Day(3), pop=off), Seq.M(t=Day(3), pop=on)],
+        )
+
+    def test_bad_columns(self) -> None:
+        with self.assertRaises(ValueError):
+            FactStore().append(Seq.M, t=[3])
+        with self.assertRaises(ValueError):
+            FactStore().append(Seq.M, t=[3, 4], pop=["on"])
+
+    def test_fingerprint(self) -> None:
+        facts = FactStore()
+        facts.append(Seq.M, t=[4, 3], pop=["on", "off"])
+        facts.append(Seq.M, t=[3], pop=["on"])
+        facts.extend(reversed(trace[:2]))
+        self.assertEqual(facts.fingerprint(), store().fingerprint())
+        facts.append(Seq.M, t=[5], pop=["on"])
+        self.assertNotEqual(facts.fingerprint(), store().fingerprint())
+
+    def test_write_facts(self) -> None:
+        f = io.StringIO()
+        store().write_facts(f, Seq.M.class_relation(), lambda sort, s: len(s))
+        self.assertExpectedInline(
+            f.getvalue(),
+            """\
+3	3
+3	2
+4	2
+""",
+        )
+
+    def test_program(self) -> None:
+        for backend_name in available_backends():
+            with self.subTest(backend=backend_name):
+                listed = DatalogProgram(
+                    trace, lib.rules(), backend=get_backend(backend_name)
+                )
+                stored = DatalogProgram(
+                    [], lib.rules(), backend=get_backend(backend_name), facts=store()
+                )
+                self.assertEqual(
+                    stored.run_query(query),
+                    listed.run_query(query),
+                )
+                self.assertTrue(stored.is_edb(trace[2]))
+                self.assertEqual(set(stored.edbs()), set(trace))
+                for atom in trace:
+                    self.assertEqual(
+                        stored._engine_row(atom),
+                        listed._engine_row(atom),
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import unittest
+import unittest.mock
+import expecttest
+
+from cea import souffle
+from cea.core import *
+from cea.souffle import _parse_stdout
+from cea.stdbiolib import *
+
+from tests.fixtures import queries, trace
+
+
+class Test(expecttest.TestCase):
+    def test_parse_stdout(self) -> None:
+        output = _parse_stdout(
+            [
+                "---------------\n",
+                "Goal\n",
+                "x\ty\n",
+                "===============\n",
+                "1\tp0\n",
+                "2\tp1\n",
+                "===============\n",
+                "---------------\n",
+                "Feasible\n",
+                "\n",
+                "===============\n",
+                "()\n",
+                "===============\n",
+                "---------------\n",
+                "Empty\n",
+                "x\n",
+                "===============\n",
+                "===============\n",
+            ]
+        )
+        self.assertEqual(
+            output.facts,
+            {"Goal": [("1", "p0"), ("2", "p1")], "Feasible": [()], "Empty": []},
+        )
+
+    def test_debug_runs_bounded(self) -> None:
+        with tempfile.TemporaryDirectory() as dirname:
+            os.mkdir(f"{dirname}/other")
+            for i in range(souffle._DEBUG_RUNS + 5):
+                souffle._dump(f"// {i}", "", dirname)
+            runs = sorted(os.listdir(dirname))
+            self.assertEqual(len(runs), souffle._DEBUG_RUNS + 1)
+            self.assertEqual(runs[-1], "other")
+
+            # The oldest runs went first
+            programs = []
+            for name in runs[:-1]:
+                self.assertEqual(
+                    sorted(os.listdir(f"{dirname}/{name}")), ["err.txt", "prog.txt"]
+                )
+                with open(f"{dirname}/{name}/prog.txt") as f:
+                    programs.append(f.read())
+            self.assertEqual(
+                programs, [f"// {i}" for i in range(5, souffle._DEBUG_RUNS + 5)]
+            )
+
+    def test_debug_runs_concurrent(self) -> None:
+        with tempfile.TemporaryDirectory() as dirname:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                list(
+                    executor.map(
+                        lambda i: souffle._dump(f"// {i}", "", dirname),
+                        range(2 * souffle._DEBUG_RUNS),
+                    )
+                )
+            # A run renamed into place just after a newer one pruned may
+            # outlive it, but at most one per worker
+            runs = os.listdir(dirname)
+            self.assertFalse([name for name in runs if name.startswith(".")])
+            self.assertLessEqual(len(runs), souffle._DEBUG_RUNS + 8)
+
+    def test_failure(self) -> None:
+        with tempfile.TemporaryDirectory() as bin_dirname:
+            fake = f"{bin_dirname}/souffle"
+            with open(fake, "w") as f:
+                f.write("#!/bin/sh\necho 'Error: no such relation' >&2\nexit 1\n")
+            os.chmod(fake, 0o755)
+            path = bin_dirname + os.pathsep + os.environ.get("PATH", "")
+
+            with unittest.mock.patch.dict(os.environ, {"PATH": path}):
+                runs = {
+                    "run": lambda: souffle.run("Goal()."),
+                    "run_piped": lambda: souffle.run_piped("Goal()."),
+                    "run_async": lambda: asyncio.run(souffle.run_async("Goal().")),
+                    "run_async piped": lambda: asyncio.run(
+                        souffle.run_async("Goal().", piped=True)
+                    ),
+                    "run_compiled": lambda: souffle.run_compiled(fake, bin_dirname),
+                    "run_compiled_async": lambda: asyncio.run(
+                        souffle.run_compiled_async(fake, bin_dirname)
+                    ),
+                }
+                for name, run in runs.items():
+                    with self.subTest(run=name):
+                        with self.assertRaisesRegex(RuntimeError, "no such relation"):
+                            run()
+
+                for name in ["souffle-interpreted", "souffle-piped"]:
+                    program = DatalogProgram(
+                        trace, lib.rules(), backend=get_backend(name)
+                    )
+                    with self.subTest(backend=name):
+                        with self.assertRaisesRegex(RuntimeError, "no such relation"):
+                            program.run_query(queries[0])
+
+                with tempfile.TemporaryDirectory() as debug_dirname:
+                    with self.assertRaises(RuntimeError):
+                        souffle.run("Goal().", debug_dirname=debug_dirname)
+                    (run_dirname,) = os.listdir(debug_dirname)
+                    with open(f"{debug_dirname}/{run_dirname}/err.txt") as f:
+                        self.assertEqual(f.read(), "Error: no such relation\n")
+
+
+if __name__ == "__main__":
+    unittest.main()